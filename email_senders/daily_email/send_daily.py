@@ -76,6 +76,10 @@ def generate_email_html(events, subject, link_ref):
         # create date header
         html += '<div style="color: #1E1E1E;font-size: 1.2em;margin-top:10px;font-weight: bold;">{0}</div>'.format(date['date'])
 
+        # adds link adding all events of the date at once
+        if len(date['events']) > 1:
+            html += '<a style="font-size:.8em;" href="www.hks.today/add_all_to_google_cal/{0}?event_ids={1}">(Add All to Calendar)</a><br>'.format("weekly_email", ','.join(str(event['id']) for event in date['events']))
+
         # adds event info
         for event in date['events']:
             html += '<a href="www.hks.today/{0}/{1}"><div style="color:#A51C30;font-size:1em;font-weight:bold;margin-top:10px;text-decoration:none;">{2}</div></a>'.format(event['id'], link_ref, event['title'])
@@ -0,0 +1,129 @@
+"""
+Re-parses archived event pages (see `Scraper.add_events_to_db`) with the current parser across a process pool and
+bulk-upserts the corrected events, without touching the network. Database configuration is read from the same
+MYSQL_* environment variables as run_scrapers.py
+
+Usage:
+    python backfill.py [--source hks] [--since 2018-09-01] [--processes N] [--batch-size 500]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import zlib
+
+import mysql.connector
+
+from scrapers import SCRAPERS
+
+# scraper used by each pool process, created by `init_worker`
+worker_scraper = None
+
+
+def init_worker(source):
+    """
+    Create the scraper used to parse pages in a pool process
+
+    Arguments:
+        source (str): source of the archived pages
+    """
+    global worker_scraper
+    worker_scraper = SCRAPERS[source].from_environ(None)
+
+
+def reparse_page(archived_page):
+    """
+    Parse an archived page in a pool process
+
+    Arguments:
+        archived_page (tuple): (source id, compressed html) of the page
+
+    Returns:
+        event_info (dict or None): parsed event, None if parsing failed
+    """
+    source_id, compressed_html = archived_page
+    try:
+        event_info = worker_scraper.parse_event_page(zlib.decompress(compressed_html).decode('utf-8'))
+    except Exception as error:
+        print('Failed to parse {0}: {1!r}'.format(source_id, error))
+        return None
+    event_info['source_id'] = source_id
+    return event_info
+
+
+def get_archived_pages(dbconfig, source, since=None):
+    """
+    Get the latest archived page of every event of a source
+
+    Arguments:
+        dbconfig (dict): dict of configuration for database
+        source (str): source of the pages
+        since (str): only get pages fetched on or after this date, None for all pages
+
+    Returns:
+        archived_pages (list of tuples): (source id, compressed html) of each event
+    """
+    conn = mysql.connector.connect(**dbconfig)
+    cursor = conn.cursor()
+    cursor.execute('select archive.source_id, archive.html from event_page_archive archive '
+                   'join (select source_id, max(fetched_at) fetched_at from event_page_archive '
+                   '      where source = %s and fetched_at >= %s group by source_id) latest '
+                   'on archive.source_id = latest.source_id and archive.fetched_at = latest.fetched_at '
+                   'where archive.source = %s',
+                   (source, since or '1970-01-01', source))
+    archived_pages = {source_id: bytes(html) for source_id, html in cursor}
+    cursor.close()
+    conn.close()
+    return list(archived_pages.items())
+
+
+def backfill(dbconfig, source, since=None, processes=None, batch_size=500):
+    """
+    Re-parse the archived pages of a source and upsert the events
+
+    Arguments:
+        dbconfig (dict): dict of configuration for database
+        source (str): source of the pages
+        since (str): only re-parse pages fetched on or after this date, None for all pages
+        processes (int): size of the process pool, defaults to the number of cpus
+        batch_size (int): number of events written per insert statement
+
+    Returns:
+        record (dict): `ScrapeStats.to_dict` record of the backfill
+    """
+    scraper = SCRAPERS[source].from_environ(dbconfig)
+    with scraper.stats.timer('total'):
+        with scraper.stats.timer('archive'):
+            archived_pages = get_archived_pages(dbconfig, source, since)
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(source, )) as pool:
+            events = pool.imap(reparse_page, archived_pages, chunksize=16)
+            events_log = scraper.add_events_to_db((event for event in events if event is not None), batch_size)
+    record = scraper.stats.to_dict()
+    record['events_log'] = events_log
+    record['counters']['pages'] = len(archived_pages)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default='hks', choices=sorted(SCRAPERS), help='source of the archived pages')
+    parser.add_argument('--since', help='only re-parse pages fetched on or after this date (YYYY-MM-DD)')
+    parser.add_argument('--processes', type=int, help='size of the parsing process pool, defaults to cpu count')
+    parser.add_argument('--batch-size', type=int, default=500, help='events written per insert statement')
+    args = parser.parse_args()
+
+    dbconfig = {
+        'host': os.environ['MYSQL_HOST'],
+        'database': os.environ['MYSQL_DB'],
+        'user': os.environ['MYSQL_USERNAME'],
+        'password': os.environ['MYSQL_PASSWORD'],
+    }
+    start = time.time()
+    record = backfill(dbconfig, args.source, args.since, args.processes, args.batch_size)
+    print(json.dumps(record))
+    print('Re-parsed {0} pages in {1:.1f}s'.format(record['counters']['pages'], time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Checks that the fast and full event page parsers return identical event dicts and compares their CPU time
+
+Usage:
+    python benchmark_parser.py [--iterations N] [page.html ...]
+"""
+import argparse
+import glob
+import os
+import time
+
+from scrapers import HKSScraper
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def cpu_per_page(scraper, pages, iterations):
+    """
+    Measure CPU time taken to parse each page
+
+    Arguments:
+        scraper (HKSScraper): scraper configured with the parser backend to measure
+        pages (list of str): html of event pages
+        iterations (int): number of times each page is parsed
+
+    Returns:
+        ms_per_page (float): mean CPU milliseconds per page
+    """
+    start = time.process_time()
+    for _ in range(iterations):
+        for page in pages:
+            scraper.parse_event_page(page)
+    return (time.process_time() - start) * 1000 / (iterations * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', help='event page html files, defaults to the fixtures directory')
+    parser.add_argument('--iterations', type=int, default=50, help='times each page is parsed per backend')
+    args = parser.parse_args()
+
+    paths = args.pages or sorted(glob.glob(os.path.join(FIXTURES_DIR, 'event_page*.html')))
+    pages = []
+    for path in paths:
+        with open(path, encoding='utf-8') as page_file:
+            pages.append(page_file.read())
+
+    full_scraper = HKSScraper(None, None, None, fast_parse=False)
+    fast_scraper = HKSScraper(None, None, None, fast_parse=True)
+
+    # both backends must produce byte-identical dicts
+    for path, page in zip(paths, pages):
+        full_event = full_scraper.parse_event_page(page)
+        fast_event = fast_scraper.parse_event_page(page)
+        if repr(full_event) != repr(fast_event):
+            raise AssertionError('Parsers differ on {0}:\n{1}\n{2}'.format(path, full_event, fast_event))
+    print('{0} pages parsed identically'.format(len(pages)))
+
+    full_ms = cpu_per_page(full_scraper, pages, args.iterations)
+    fast_ms = cpu_per_page(fast_scraper, pages, args.iterations)
+    print('full parser: {0:.2f} ms CPU / page'.format(full_ms))
+    print('fast parser: {0:.2f} ms CPU / page ({1:.1f}x)'.format(fast_ms, full_ms / fast_ms))
+
+
+if __name__ == '__main__':
+    main()
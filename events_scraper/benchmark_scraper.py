@@ -0,0 +1,369 @@
+"""
+End to end throughput benchmark for HKSScraper.get_new_events, run against a local stand-in for KNET serving
+synthetic listing and event pages (built from fixtures/event_page.html) and an in-memory stand-in for the
+events database
+
+Usage:
+    python benchmark_scraper.py [--sizes 100 1000 10000] [--latency-ms 50] [--jitter-ms 20] [--max-workers 8]
+                                [--requests-per-second 1000] [--shards N]
+
+With --shards the run goes through the `run_scrapers.coordinate` fan-out on a local process pool, with a
+database stand-in per shard process. The fan-out is then also run on an empty listing and with one failing shard,
+which must still produce merged records
+"""
+import argparse
+import functools
+import os
+import random
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from concurrent.futures import ProcessPoolExecutor
+
+from run_scrapers import coordinate, run_shard
+from scrapers import HKSScraper, EVENT_COLUMNS
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_TITLE = 'Building Resilient Cities: Lessons from Latin America'
+
+
+class KNETStandIn(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Local http server imitating the KNET login, AllEvents.aspx listing and event pages
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, num_events, latency_ms=0, jitter_ms=0):
+        """
+        Initialize server on a free localhost port
+
+        Arguments:
+            num_events (int): number of events in the listing
+            latency_ms (float): delay added to every response
+            jitter_ms (float): max random delay added on top of latency_ms
+        """
+        super().__init__(('127.0.0.1', 0), KNETRequestHandler)
+        self.num_events = num_events
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.session_tokens = set()
+        with open(os.path.join(FIXTURES_DIR, 'event_page.html'), encoding='utf-8') as page_file:
+            self.event_page_template = page_file.read()
+
+    @property
+    def root_url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    def event_url(self, event_number):
+        return '{0}/Events/Lists/DispForm.aspx?ID={1}'.format(self.root_url, event_number)
+
+    def delay(self):
+        """
+        Sleep for the injected latency
+        """
+        delay_ms = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def start(self):
+        """
+        Serve requests on a background thread
+
+        Returns:
+            self (KNETStandIn): the running server
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def configure(self, scraper):
+        """
+        Point a scraper at this server instead of KNET
+
+        Arguments:
+            scraper (HKSScraper): scraper to configure
+        """
+        configure_scraper(scraper, self.root_url)
+
+
+def configure_scraper(scraper, root_url):
+    """
+    Point a scraper at a KNETStandIn
+
+    Arguments:
+        scraper (HKSScraper): scraper to configure
+        root_url (str): root url of the server
+    """
+    scraper.base_url = root_url + '/CookieAuth.dll?Logon'
+    scraper.events_url = root_url + '/Pages/AllEvents.aspx'
+
+
+class KNETRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for KNETStandIn
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send_html(self, html, status=200, headers=None):
+        body = html.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.delay()
+        session_token = uuid.uuid4().hex
+        self.server.session_tokens.add(session_token)
+        self.send_html('<html><body>Logged in</body></html>',
+                       headers={'Set-Cookie': 'cadata={0}; path=/'.format(session_token)})
+
+    def do_GET(self):
+        self.server.delay()
+        url = urlparse(self.path)
+        cookies = dict(cookie.strip().split('=', 1)
+                       for cookie in self.headers.get('Cookie', '').split(';') if '=' in cookie)
+        if url.path == '/CookieAuth.dll':
+            self.send_html('<html><body><form action="/CookieAuth.dll?Logon">Log On</form></body></html>')
+        elif cookies.get('cadata') not in self.server.session_tokens:
+            # like KNET, redirect requests without a valid session to the login page
+            self.send_html('', status=302, headers={'Location': '/CookieAuth.dll?GetLogon?curl=' + url.path})
+        elif url.path == '/Pages/AllEvents.aspx':
+            links = ''.join('<a href="{0}">Event {1}</a>'.format(self.server.event_url(i), i)
+                            for i in range(1, self.server.num_events + 1))
+            self.send_html('<html><body><div id="WebPartWPQ7">{0}</div></body></html>'.format(links))
+        elif url.path == '/Events/Lists/DispForm.aspx':
+            event_number = parse_qs(url.query)['ID'][0]
+            etag = '"event-{0}"'.format(event_number)
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_html(self.server.event_page_template.replace(FIXTURE_TITLE,
+                                                                   '{0} #{1}'.format(FIXTURE_TITLE, event_number)),
+                           headers={'ETag': etag})
+        else:
+            self.send_html('<html><body>Not Found</body></html>', status=404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DatabaseStandIn(object):
+    """
+    In-memory stand-in for the events and cache_versions tables, answering the statements issued by
+    `Scraper.add_events_to_db`
+    """
+
+    def __init__(self, latency_ms=0):
+        """
+        Initialize database
+
+        Arguments:
+            latency_ms (float): delay added to every statement and commit
+        """
+        self.latency_ms = latency_ms
+        self.rows = {}
+        self.events_version = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return DatabaseStandInConnection(self)
+
+    def delay(self):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+
+
+class DatabaseStandInConnection(object):
+
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self):
+        return DatabaseStandInCursor(self.database)
+
+    def commit(self):
+        self.database.delay()
+
+    def close(self):
+        pass
+
+
+class DatabaseStandInCursor(object):
+
+    def __init__(self, database):
+        self.database = database
+        self.rowcount = -1
+        self.results = []
+
+    def execute(self, operation, params=()):
+        self.database.delay()
+        with self.database.lock:
+            rows = self.database.rows
+            if operation.startswith('insert into events'):
+                # rows are source, source_id ... key_terms, tile_json, content_hash, date_added
+                row_width = len(EVENT_COLUMNS) + 4
+                self.rowcount = 0
+                for i in range(0, len(params), row_width):
+                    row = params[i:i + row_width]
+                    source_id, content_hash, date_added = row[1], row[-2], row[-1]
+                    existing = rows.get(source_id)
+                    if existing is None:
+                        rows[source_id] = (content_hash, date_added)
+                        self.rowcount += 1
+                    elif existing[0] != content_hash:
+                        rows[source_id] = (content_hash, existing[1])
+                        self.rowcount += 2
+                    else:
+                        self.rowcount += 1
+            elif operation.startswith('select count(*) from events where scraped_source_id in'):
+                source_ids, date_added = params[:-1], params[-1]
+                self.results = [(sum(1 for source_id in source_ids if rows[source_id][1] == date_added), )]
+            elif operation.startswith('insert into cache_versions'):
+                self.database.events_version += 1
+            else:
+                raise ValueError('Unsupported statement: {0}'.format(operation))
+
+    def fetchone(self):
+        return self.results.pop(0)
+
+    def close(self):
+        pass
+
+
+class StandInHKSScraper(HKSScraper):
+    """
+    HKSScraper writing to a DatabaseStandIn
+    """
+
+    def __init__(self, database, max_workers, requests_per_second):
+        super().__init__(None, None, None, max_workers=max_workers,
+                         scheduler_options={'max_requests_per_second': requests_per_second})
+        self.database = database
+
+    def connect_to_db(self):
+        return self.database.connect()
+
+
+def create_stand_in_scraper(root_url, db_latency_ms, max_workers, requests_per_second):
+    """
+    Create a scraper using a KNETStandIn and a fresh DatabaseStandIn, picklable through functools.partial so shard
+    processes can build their own
+
+    Returns:
+        scraper (StandInHKSScraper): configured scraper
+    """
+    scraper = StandInHKSScraper(DatabaseStandIn(db_latency_ms), max_workers, requests_per_second)
+    configure_scraper(scraper, root_url)
+    return scraper
+
+
+def run_failing_shard(scraper_factory, failing_link_id, links, session_state=None):
+    """
+    Shard runner failing the shard with the given link, and running the other shards like `run_shard`
+    """
+    if failing_link_id in links:
+        raise RuntimeError('Shard with {0} failed'.format(failing_link_id))
+    return run_shard(scraper_factory, links, session_state)
+
+
+def run_shard_edge_cases(db_latency_ms, max_workers, requests_per_second, shards):
+    """
+    Run the sharded fan-out on an empty listing, and on a listing where one shard fails
+
+    Returns:
+        records (dict): merged records of the runs keyed by 'empty listing' and 'failing shard'
+    """
+    records = {}
+    for case, num_events in (('empty listing', 0), ('failing shard', 2 * shards)):
+        server = KNETStandIn(num_events).start()
+        try:
+            scraper_factory = functools.partial(create_stand_in_scraper, server.root_url, db_latency_ms, max_workers,
+                                                requests_per_second)
+            scraper = scraper_factory()
+            if case == 'failing shard':
+                failing_link_id = scraper.create_event_source_id(server.event_url(1))
+                shard_runner = functools.partial(run_failing_shard, scraper_factory, failing_link_id)
+            else:
+                shard_runner = functools.partial(run_shard, scraper_factory)
+            with ProcessPoolExecutor(max_workers=shards) as executor:
+                records[case] = coordinate(scraper, shard_runner, shards, executor)
+        finally:
+            server.shutdown()
+            server.server_close()
+    return records
+
+
+def run_benchmark(num_events, latency_ms, jitter_ms, db_latency_ms, max_workers, requests_per_second, shards=1):
+    """
+    Run the scraper once against fresh stand-ins
+
+    Returns:
+        record (dict): `ScrapeStats.to_dict` record of the run (merged over shards if sharded), with the run's
+            wall time
+    """
+    server = KNETStandIn(num_events, latency_ms, jitter_ms).start()
+    try:
+        scraper_factory = functools.partial(create_stand_in_scraper, server.root_url, db_latency_ms, max_workers,
+                                            requests_per_second)
+        start = time.perf_counter()
+        if shards > 1:
+            with ProcessPoolExecutor(max_workers=shards) as executor:
+                record = coordinate(scraper_factory(), functools.partial(run_shard, scraper_factory), shards,
+                                    executor)
+        else:
+            record = scraper_factory().get_new_events()
+        record['wall_time'] = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='events per listing')
+    parser.add_argument('--latency-ms', type=float, default=50, help='latency added to every KNET response')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='max random latency added on top')
+    parser.add_argument('--db-latency-ms', type=float, default=5, help='latency added to every db statement')
+    parser.add_argument('--max-workers', type=int, default=8, help='concurrent event page fetches')
+    parser.add_argument('--requests-per-second', type=float, default=1000, help='request rate limit of the scraper')
+    parser.add_argument('--shards', type=int, default=1, help='shard processes the listing is split across')
+    args = parser.parse_args()
+
+    for num_events in args.sizes:
+        record = run_benchmark(num_events, args.latency_ms, args.jitter_ms, args.db_latency_ms, args.max_workers,
+                               args.requests_per_second, args.shards)
+        timings = record['timings']
+        print('{0} events: {1:.1f} events/sec, {2:.2f}s wall'.format(
+            num_events, num_events / record['wall_time'], record['wall_time']))
+        if record['page_latency_p50'] is not None:
+            print('    page latency p50 {0:.1f} ms, p95 {1:.1f} ms'.format(
+                record['page_latency_p50'] * 1000, record['page_latency_p95'] * 1000))
+        print('    login {0:.2f}s, listing {1:.2f}s, fetch {2:.2f}s (summed over workers), parse {3:.2f}s, '
+              'db {4:.2f}s'.format(*(timings.get(phase, 0) for phase in ('login', 'listing', 'fetch', 'parse', 'db'))))
+        print('    {0} inserted, {1} updated, {2} unchanged, {3} errors'.format(
+            *(record['counters'].get(counter, 0) for counter in ('inserts', 'updates', 'unchanged', 'errors'))))
+        if 'error' in record:
+            print('    failed: {0}'.format(record['error']))
+
+    if args.shards > 1:
+        records = run_shard_edge_cases(args.db_latency_ms, args.max_workers, args.requests_per_second, args.shards)
+        for case, record in records.items():
+            print('{0}: {1} shards, {2} inserted, error: {3}'.format(
+                case, len(record['shards']), record['counters'].get('inserts', 0), record.get('error')))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,8 @@ cd scraper-env/lib/python3.6/site-packages/
 zip -r9 ../../../../ScraperLambdaDeploymentPackage.zip *
 cd ../../../../
 zip -g ScraperLambdaDeploymentPackage.zip scrapers.py
+zip -g ScraperLambdaDeploymentPackage.zip http_cache.py
+zip -g ScraperLambdaDeploymentPackage.zip http_scheduler.py
+zip -g ScraperLambdaDeploymentPackage.zip scrape_stats.py
+zip -g ScraperLambdaDeploymentPackage.zip session_store.py
 zip -g ScraperLambdaDeploymentPackage.zip run_scrapers.py
\ No newline at end of file
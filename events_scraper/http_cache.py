@@ -0,0 +1,111 @@
+import datetime
+import sqlite3
+import threading
+import zlib
+
+
+class CacheMissError(Exception):
+    """
+    Raised in replay mode when a url has not been cached
+    """
+
+
+class ResponseCache(object):
+    """
+    URL keyed store of compressed response bodies in sqlite, used to revalidate pages with ETag / Last-Modified
+    and to replay a scrape without network access
+    """
+
+    def __init__(self, path):
+        """
+        Open (or create) the cache
+
+        Arguments:
+            path (str): path of the sqlite file
+        """
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute('create table if not exists responses (url text primary key, body blob not null, '
+                              'etag text, last_modified text, fetched_at text not null)')
+            self.conn.commit()
+
+    def lookup(self, url):
+        """
+        Get a cached response
+
+        Arguments:
+            url (str): url of page
+
+        Returns:
+            response (tuple or None): (body, etag, last_modified) of the cached page or None if not cached
+        """
+        with self.lock:
+            row = self.conn.execute('select body, etag, last_modified from responses where url = ?',
+                                    (url, )).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified = row
+        return zlib.decompress(body).decode('utf-8'), etag, last_modified
+
+    def store(self, url, body, etag=None, last_modified=None):
+        """
+        Cache a response
+
+        Arguments:
+            url (str): url of page
+            body (str): text of page
+            etag (str): ETag header of response
+            last_modified (str): Last-Modified header of response
+        """
+        compressed_body = zlib.compress(body.encode('utf-8'))
+        fetched_at = str(datetime.datetime.today()).split('.')[0]
+        with self.lock:
+            self.conn.execute('insert or replace into responses (url, body, etag, last_modified, fetched_at) '
+                              'values (?, ?, ?, ?, ?)', (url, compressed_body, etag, last_modified, fetched_at))
+            self.conn.commit()
+
+    def get(self, session, url):
+        """
+        Get a page, revalidating the cached copy with a conditional request if one exists
+
+        Arguments:
+            session (http_scheduler.RequestScheduler or requests.Session): used to fetch the page
+            url (str): url of page
+
+        Returns:
+            body (str): text of page
+        """
+        cached = self.lookup(url)
+        headers = {}
+        if cached is not None:
+            _, etag, last_modified = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = session.get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            return cached[0]
+        self.store(url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return response.text
+
+    def replay(self, url):
+        """
+        Get a page from the cache only
+
+        Arguments:
+            url (str): url of page
+
+        Returns:
+            body (str): text of page
+        """
+        cached = self.lookup(url)
+        if cached is None:
+            raise CacheMissError('{0} is not cached'.format(url))
+        return cached[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised for every request once too many consecutive requests have failed, to stop the run
+    """
+
+
+class HostLimiter(object):
+    """
+    Caps concurrent requests to a host and spaces their start times, backing off when the host struggles
+    """
+
+    def __init__(self, max_concurrency, max_requests_per_second, min_requests_per_second):
+        """
+        Initialize limiter
+
+        Arguments:
+            max_concurrency (int): max requests in flight to the host
+            max_requests_per_second (float): request rate used while the host is healthy
+            min_requests_per_second (float): request rate the limiter backs off to at most
+        """
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.min_interval = 1 / max_requests_per_second
+        self.max_interval = 1 / min_requests_per_second
+        self.interval = self.min_interval
+        self.next_start = time.monotonic()
+
+    def __enter__(self):
+        self.semaphore.acquire()
+
+        # reserve the next start slot and wait for it
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.semaphore.release()
+
+    def slow_down(self):
+        """
+        Halve the request rate
+        """
+        with self.lock:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def speed_up(self):
+        """
+        Creep the request rate back towards the max
+        """
+        with self.lock:
+            self.interval = max(self.interval * 0.9, self.min_interval)
+
+
+class RequestScheduler(object):
+    """
+    Wraps a requests.Session with per-host concurrency and rate limits, timeouts, retries with jittered exponential
+    backoff on server errors and timeouts, and a circuit breaker. Exposes the `get` / `post` methods of the session
+    so it can be used in place of one
+    """
+
+    def __init__(self, session, max_concurrency=8, max_requests_per_second=20, min_requests_per_second=0.5,
+                 connect_timeout=5, read_timeout=30, max_retries=3, backoff_base=0.5, backoff_max=30,
+                 failure_threshold=10):
+        """
+        Initialize scheduler
+
+        Arguments:
+            session (requests.Session): session used to send requests
+            max_concurrency (int): max requests in flight per host
+            max_requests_per_second (float): max request rate per host
+            min_requests_per_second (float): rate a struggling host is backed off to at most
+            connect_timeout (float): seconds to wait for a connection
+            read_timeout (float): seconds to wait between bytes of the response
+            max_retries (int): retries of a request that timed out or got a 429 / 5xx response
+            backoff_base (float): seconds waited before the first retry, doubled for each retry after that
+            backoff_max (float): max seconds waited before a retry
+            failure_threshold (int): consecutive failed attempts after which the circuit opens
+        """
+        self.session = session
+        self.max_concurrency = max_concurrency
+        self.max_requests_per_second = max_requests_per_second
+        self.min_requests_per_second = min_requests_per_second
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.consecutive_failures = 0
+        self.bytes_downloaded = 0
+        self.retries = 0
+        self.host_limiters = {}
+        self.lock = threading.Lock()
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def get_host_limiter(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_limiters:
+                self.host_limiters[host] = HostLimiter(self.max_concurrency,
+                                                       self.max_requests_per_second,
+                                                       self.min_requests_per_second)
+            return self.host_limiters[host]
+
+    def record_attempt(self, succeeded):
+        """
+        Track consecutive failed attempts, opening the circuit once they reach failure_threshold
+        """
+        with self.lock:
+            self.consecutive_failures = 0 if succeeded else self.consecutive_failures + 1
+
+    def check_circuit(self):
+        if self.consecutive_failures >= self.failure_threshold:
+            raise CircuitOpenError('{0} consecutive requests failed'.format(self.consecutive_failures))
+
+    def backoff(self, attempt):
+        """
+        Sleep before a retry, using full jitter so concurrent retries spread out
+        """
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request, retrying timeouts, connection errors and 429 / 5xx responses
+
+        Arguments:
+            method (str): http method
+            url (str): url of request
+            **kwargs: passed to `requests.Session.request`
+
+        Returns:
+            response (requests.Response): response of the request
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host_limiter = self.get_host_limiter(url)
+        for attempt in range(self.max_retries + 1):
+            self.check_circuit()
+            with host_limiter:
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    error = None
+                except (requests.Timeout, requests.ConnectionError) as request_error:
+                    response = None
+                    error = request_error
+
+            if response is not None and response.status_code != 429 and response.status_code < 500:
+                self.record_attempt(True)
+                host_limiter.speed_up()
+                with self.lock:
+                    self.bytes_downloaded += len(response.content)
+                return response
+
+            self.record_attempt(False)
+            host_limiter.slow_down()
+            if attempt < self.max_retries:
+                with self.lock:
+                    self.retries += 1
+                self.backoff(attempt)
+
+        # out of retries
+        if error is not None:
+            raise error
+        response.raise_for_status()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
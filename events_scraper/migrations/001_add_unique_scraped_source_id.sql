@@ -0,0 +1,7 @@
+-- Unique key used by `Scraper.add_events_to_db` to upsert scraped events.
+-- source_id alone can't be unique because user submitted events store the submitting user's id there,
+-- so the key is on a generated column that is NULL for user events (NULLs never collide in a unique index).
+-- Requires MySQL 5.7+. Remove any duplicate scraped source_ids before running.
+alter table events
+    add column scraped_source_id varchar(256) as (if(source = 'user', null, source_id)) stored,
+    add unique key uq_events_scraped_source_id (scraped_source_id);
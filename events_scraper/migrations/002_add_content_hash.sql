@@ -0,0 +1,3 @@
+-- Fingerprint of the parsed event, used by `Scraper.add_events_to_db` to skip updates of unchanged events.
+alter table events
+    add column content_hash char(40);
@@ -0,0 +1,3 @@
+-- events.source holds the source registered for each scraper (see `scrapers.register_scraper`) or 'user'.
+alter table events
+    modify column source varchar(32) not null;
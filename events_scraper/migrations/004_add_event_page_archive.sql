@@ -0,0 +1,10 @@
+-- Compressed (zlib) html of every fetched event page, written by `Scraper.add_events_to_db` and re-parsed by
+-- backfill.py.
+create table event_page_archive (
+    id bigint not null auto_increment primary key,
+    source varchar(32) not null,
+    source_id varchar(256) not null,
+    fetched_at datetime not null,
+    html mediumblob not null,
+    key ix_event_page_archive_source_id_fetched_at (source, source_id, fetched_at)
+);
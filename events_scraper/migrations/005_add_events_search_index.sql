@@ -0,0 +1,4 @@
+-- Full text index serving the search of the website's `query_helpers.get_event_tiles` (InnoDB, MySQL 5.6+).
+alter table events
+    add fulltext index ix_events_search (description, title, policy_topics, academic_areas, geographic_regions,
+                                         degrees_programs, centers_initiatives);
@@ -0,0 +1,9 @@
+-- Version counters of cached data. The website caches upcoming events in process until the 'events' row changes,
+-- which the website bumps when users add or delete events and the scrapers bump when they write events.
+create table cache_versions (
+    name varchar(50) not null,
+    version int not null default 0,
+    primary key (name)
+);
+
+insert into cache_versions (name, version) values ('events', 0);
@@ -0,0 +1,18 @@
+-- Durable queue of the website's Google Calendar inserts (see HarvardEvents/utils/calendar_jobs.py), so that the
+-- inserts happen off the request and are retried across worker restarts.
+create table calendar_jobs (
+    id int not null auto_increment,
+    user_id varchar(50) not null,
+    event_id int not null,
+    selection_source varchar(32) not null,
+    status enum('pending', 'running', 'done', 'failed') not null default 'pending',
+    attempts int not null default 0,
+    error text,
+    created_at datetime not null,
+    updated_at datetime not null,
+    next_attempt_at datetime not null,
+    primary key (id),
+    key ix_calendar_jobs_next_attempt_at (next_attempt_at),
+    foreign key (user_id) references users (id),
+    foreign key (event_id) references events (id)
+);
@@ -0,0 +1,7 @@
+-- Groups the calendar jobs of the website's "add all to calendar" requests, which are sent as one Google batch
+-- http request, and records which worker thread claimed each job so a batch can be claimed with one update.
+alter table calendar_jobs
+    add column batch_id varchar(32) null after selection_source,
+    add column claim_id varchar(32) null after batch_id,
+    add key ix_calendar_jobs_batch_id (batch_id),
+    add key ix_calendar_jobs_claim_id (claim_id);
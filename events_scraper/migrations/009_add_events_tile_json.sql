@@ -0,0 +1,4 @@
+-- Tile the website lists an event with, serialized as json when the event is written by the scrapers or the
+-- website (without the event id, which the website adds on read).
+alter table events
+    add column tile_json mediumtext null;
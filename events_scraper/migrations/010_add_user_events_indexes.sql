@@ -0,0 +1,7 @@
+-- Composite indexes serving the website's preferences page (`query_helpers.get_user_events`): the events a user
+-- submitted, which store the user's id as source_id, and the events a user added to their calendar.
+alter table events
+    add key ix_events_source_id_start_time (source_id, start_time);
+
+alter table selected_events
+    add key ix_selected_events_user_type_event (user_id, selection_type, event_id);
@@ -0,0 +1,4 @@
+-- sha1 of the raw html of each archived event page, so `Scraper.archive_event_pages` skips pages identical to
+-- the latest archived copy. Pages archived before this column existed have no hash and are archived once more.
+alter table event_page_archive
+    add column html_hash char(40) null after html;
@@ -1,37 +1,173 @@
+import functools
+import json
 import os
-from scrapers import HKSScraper
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from scrapers import SCRAPERS
+from scrape_stats import failed_record, merge_records
 
 
-def scrape_data(hks_config, dbconfig):
+def partition_links(links, num_shards):
     """
-    Runs HKS Scraper
+    Split event links into shards of (nearly) equal size
 
     Arguments:
-        hks_config (dict): dict of configuration for hks scraper
+        links (dict): event links keyed by source id
+        num_shards (int): number of shards
+
+    Returns:
+        shards (list of dicts): non-empty subsets of links, each link in exactly one shard
+    """
+    shards = [{} for _ in range(num_shards)]
+    for index, (link_id, link) in enumerate(links.items()):
+        shards[index % num_shards][link_id] = link
+    return [shard for shard in shards if shard]
+
+
+def run_shard(scraper_factory, links, session_state=None):
+    """
+    Scrape a shard in the current process, used as the shard runner of local process pools
+
+    Arguments:
+        scraper_factory (callable): picklable function returning a configured scraper
+        links (dict): event links of the shard
+        session_state (json serializable or None): session of the coordinator, see `Scraper.export_session`
+
+    Returns:
+        record (dict): record of the shard, see `scrape_data`
+    """
+    scraper = scraper_factory()
+    scraper.restore_session(session_state)
+    return scrape_data(scraper, links)
+
+
+def invoke_shard(function_name, source, links, session_state=None):
+    """
+    Scrape a shard in its own invocation of the scraper lambda, used as the shard runner in production. Invocations
+    don't share /tmp, so the coordinator's session is passed in the payload for the shard to reuse
+
+    Arguments:
+        function_name (str): name of the scraper lambda
+        source (str): source of the scraper
+        links (dict): event links of the shard
+        session_state (json serializable or None): session of the coordinator, see `Scraper.export_session`
+
+    Returns:
+        record (dict): record of the shard, see `scrape_data`
+    """
+    # boto3 is provided by the lambda runtime
+    import boto3
+
+    response = boto3.client('lambda').invoke(FunctionName=function_name,
+                                             InvocationType='RequestResponse',
+                                             Payload=json.dumps({'shard': {'source': source,
+                                                                                  'links': links,
+                                                                                  'session': session_state}}))
+    payload = json.loads(response['Payload'].read())
+    if 'FunctionError' in response:
+        return failed_record(source, json.dumps(payload))
+    return payload
+
+
+def coordinate(scraper, shard_runner, num_shards, executor):
+    """
+    Run a scraper sharded: log in and fetch the listing once, split it into shards and scrape each shard in an
+    independent worker reusing the login, merging the records of the shards
+
+    Arguments:
+        scraper (scrapers.Scraper): configured scraper, used to list the events
+        shard_runner (callable): picklable function taking the links of a shard and the session state of the
+            scraper, and returning the record of the shard
+        num_shards (int): number of shards
+        executor (concurrent.futures.Executor): pool the shard runners are submitted to
+
+    Returns:
+        record (dict): merged record of the run, see `scrape_stats.merge_records`
+    """
+    start = time.time()
+    links = scraper.list_events()
+    session_state = scraper.export_session()
+    futures = [executor.submit(shard_runner, shard, session_state) for shard in partition_links(links, num_shards)]
+    records = []
+    for future in futures:
+        try:
+            records.append(future.result())
+        except Exception as error:
+            records.append(failed_record(scraper.source, repr(error)))
+    record = merge_records(scraper.source, records, time.time() - start)
+    for phase in ('login', 'listing'):
+        record['timings'][phase] = record['timings'].get(phase, 0) + scraper.stats.timings[phase]
+    return record
+
+
+def scrape_data(scraper, links=None):
+    """
+    Runs a scraper
+
+    Arguments:
+        scraper (scrapers.Scraper): configured scraper
+        links (dict): subset of the scraper's events to scrape, None for all of them
+
+    Returns:
+        record (dict): timings and counters of the run, see `scrape_stats.ScrapeStats.to_dict`, with an error key
+            if the scraper failed
+    """
+    print('Running {0} Scraper'.format(scraper.source))
+    try:
+        record = scraper.get_new_events(links)
+    except Exception as error:
+        record = scraper.stats.to_dict()
+        record['error'] = repr(error)
+    print(json.dumps(record))
+    return record
+
+
+def scrape_source(source, dbconfig, num_shards, function_name):
+    """
+    Runs the scraper of a source, sharded across lambda invocations (or local processes when not on lambda) if
+    num_shards is more than 1
+
+    Arguments:
+        source (str): source of the scraper
         dbconfig (dict): dict of configuration for database
+        num_shards (int): number of shards
+        function_name (str): name of the scraper lambda, None when running locally
 
     Returns:
-        events_log (str): describes number of events added to the db on a specific day
+        record (dict): record of the run, see `scrape_data`
     """
-    hks_scraper = HKSScraper(hks_config['username'],
-                             hks_config['password'],
-                             dbconfig)
-    print('Running Program')
-    events_log = hks_scraper.get_new_events()
-    print(events_log)
-    return events_log
+    scraper = SCRAPERS[source].from_environ(dbconfig)
+    if num_shards <= 1:
+        return scrape_data(scraper)
+
+    try:
+        if function_name:
+            shard_runner = functools.partial(invoke_shard, function_name, source)
+            with ThreadPoolExecutor(max_workers=num_shards) as executor:
+                record = coordinate(scraper, shard_runner, num_shards, executor)
+        else:
+            shard_runner = functools.partial(run_shard, functools.partial(SCRAPERS[source].from_environ, dbconfig))
+            with ProcessPoolExecutor(max_workers=num_shards) as executor:
+                record = coordinate(scraper, shard_runner, num_shards, executor)
+    except Exception as error:
+        record = scraper.stats.to_dict()
+        record['error'] = repr(error)
+    print(json.dumps(record))
+    return record
 
 
 def handler(event, context):
     """
-    Handler function used by aws lambda. Load configuration variables and run scraper
+    Handler function used by aws lambda. Load configuration variables and run every registered scraper concurrently,
+    or a single shard if invoked by a coordinator
 
     Arugments:
-        event (): required by lambda function
+        event (dict): required by lambda function, has a shard key with the source, links and session of the
+            coordinator when running a shard
         context (): required by lambda function
 
     Returns:
-        events_log (str): describes number of events added to the db on a specific day
+        run_log (dict): json serializable record of the run of every scraper, or of the shard
     """
     dbconfig = {
         'host': os.environ['MYSQL_HOST'],
@@ -39,12 +175,27 @@ def handler(event, context):
         'user': os.environ['MYSQL_USERNAME'],
         'password': os.environ['MYSQL_PASSWORD'],
     }
-    hks_config = {
-        'username': os.environ['KNET_USERNAME'],
-        'password': os.environ['KNET_PASSWORD'],
-    }
-    events_log = scrape_data(hks_config, dbconfig)
-    return events_log
+
+    # run a shard for a coordinator
+    if event and 'shard' in event:
+        scraper = SCRAPERS[event['shard']['source']].from_environ(dbconfig)
+        scraper.restore_session(event['shard'].get('session'))
+        return scrape_data(scraper, event['shard']['links'])
+
+    # run all registered scrapers unless SCRAPER_SOURCES lists a subset, e.g. "hks", each split into SCRAPER_SHARDS
+    sources = os.environ.get('SCRAPER_SOURCES')
+    sources = sources.split(',') if sources else list(SCRAPERS)
+    num_shards = int(os.environ.get('SCRAPER_SHARDS', '1'))
+    function_name = context.function_name if context is not None else None
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        records = list(executor.map(lambda source: scrape_source(source, dbconfig, num_shards, function_name),
+                                    sources))
+
+    run_log = {'scrapers': records}
+    if any('error' in record for record in records):
+        raise RuntimeError(json.dumps(run_log))
+    return run_log
 
 
 if __name__ == '__main__':
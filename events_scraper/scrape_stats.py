@@ -0,0 +1,141 @@
+import collections
+import contextlib
+import datetime
+import math
+import threading
+import time
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of a list of values
+
+    Arguments:
+        values (list of floats): values, need not be sorted
+        fraction (float): percentile between 0 and 1
+
+    Returns:
+        value (float or None): percentile of values, None if there are no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class ScrapeStats(object):
+    """
+    Thread safe wall times and counters of a scraper run
+    """
+
+    def __init__(self, source):
+        """
+        Initialize stats
+
+        Arguments:
+            source (str): source of the scraper being measured
+        """
+        self.source = source
+        self.started_at = str(datetime.datetime.today()).split('.')[0]
+        self.timings = collections.defaultdict(float)
+        self.counters = collections.defaultdict(int)
+        self.page_latencies = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """
+        Add the wall time of the with block to a phase, times from concurrent threads are summed
+
+        Arguments:
+            phase (str): name of phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.timings[phase] += seconds
+
+    def add_page_latency(self, seconds):
+        with self.lock:
+            self.timings['fetch'] += seconds
+            self.page_latencies.append(seconds)
+
+    def increment(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def to_dict(self):
+        """
+        Structured record of the run, suitable for json logging
+
+        Returns:
+            record (dict): source, start time, seconds per phase, page latency percentiles and counters
+        """
+        with self.lock:
+            p50 = percentile(self.page_latencies, 0.5)
+            p95 = percentile(self.page_latencies, 0.95)
+            return {'source': self.source,
+                    'started_at': self.started_at,
+                    'timings': {phase: round(seconds, 3) for phase, seconds in self.timings.items()},
+                    'page_latency_p50': round(p50, 3) if p50 is not None else None,
+                    'page_latency_p95': round(p95, 3) if p95 is not None else None,
+                    'counters': dict(self.counters)}
+
+
+def failed_record(source, error):
+    """
+    Record of a shard that failed without returning its own record, in the format merged by `merge_records`
+
+    Arguments:
+        source (str): source of the scraper
+        error (str): description of the failure
+
+    Returns:
+        record (dict): record without a start time, timings, page latencies or counters, with an error key
+    """
+    return {'source': source, 'started_at': None, 'timings': {}, 'page_latency_p50': None, 'page_latency_p95': None,
+            'counters': {}, 'error': error}
+
+
+def merge_records(source, records, wall_time):
+    """
+    Merge the records of the shards of a sharded run into one record
+
+    Arguments:
+        source (str): source of the scraper
+        records (list of dicts): `ScrapeStats.to_dict` records of the shards, with an error key if a shard failed
+        wall_time (float): seconds the whole sharded run took
+
+    Returns:
+        record (dict): record with timings and counters summed over shards, the median p50 and max p95 page
+            latency of the shards, and the shard records under a shards key. Records of failed shards have no
+            start time, and a run without shards (an empty listing) gets an empty record started now
+    """
+    timings = collections.defaultdict(float)
+    counters = collections.defaultdict(int)
+    for record in records:
+        for phase, seconds in record['timings'].items():
+            timings[phase] += seconds
+        for counter, count in record['counters'].items():
+            counters[counter] += count
+    timings['total'] = wall_time
+    p50s = [record['page_latency_p50'] for record in records if record['page_latency_p50'] is not None]
+    p95s = [record['page_latency_p95'] for record in records if record['page_latency_p95'] is not None]
+    started_ats = [record['started_at'] for record in records if record['started_at'] is not None]
+    merged_record = {'source': source,
+                     'started_at': min(started_ats) if started_ats else str(datetime.datetime.today()).split('.')[0],
+                     'timings': {phase: round(seconds, 3) for phase, seconds in timings.items()},
+                     'page_latency_p50': percentile(p50s, 0.5),
+                     'page_latency_p95': max(p95s) if p95s else None,
+                     'counters': dict(counters),
+                     'shards': records}
+    errors = [record['error'] for record in records if 'error' in record]
+    if errors:
+        merged_record['error'] = '; '.join(errors)
+    return merged_record
@@ -1,13 +1,172 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import abc
+import contextlib
+from mysql.connector.constants import ClientFlag
 import requests
 import datetime
+import functools
+import hashlib
+import itertools
+import json
 import mysql.connector
+import os
+import threading
+import time
+import zlib
+
+from http_cache import ResponseCache
+from http_scheduler import CircuitOpenError, RequestScheduler
+from scrape_stats import ScrapeStats
+from session_store import SessionStore, restore_cookies, serialize_cookies
+
+# maps columns of the events table to the keys of the dicts returned by `parse_event_data`
+EVENT_COLUMNS = [('source_id', 'source_id'),
+                 ('title', 'title'),
+                 ('short_description', 'short_description'),
+                 ('speaker', 'speaker'),
+                 ('sponsor', 'sponsor'),
+                 ('co_sponsor', 'cosponsors'),
+                 ('additional_sponsor', 'additional_sponsors'),
+                 ('start_time', 'start_time'),
+                 ('end_time', 'end_time'),
+                 ('event_type', 'event_type'),
+                 ('location', 'location'),
+                 ('description', 'description'),
+                 ('intranet_homepage', 'intranet_home_page'),
+                 ('public_site', 'public_site'),
+                 ('hks_today_email', 'hks_today_email'),
+                 ('ticketed_event', 'ticketed_event'),
+                 ('ticketed_event_instructions', 'ticketed_event_instructions'),
+                 ('ad_day_one', 'advertisement_day_1'),
+                 ('ad_day_two', 'advertisement_day_2'),
+                 ('contact_name', 'contact_name'),
+                 ('contact_email', 'contact_email_address'),
+                 ('phone_number', 'phone_number'),
+                 ('rsvp_required', 'rsvp_required'),
+                 ('rsvp_date', 'rsvp_date'),
+                 ('rsvp_email_url', 'rsvp_email_or_url'),
+                 ('existing_website', 'link_to_an_existing_website'),
+                 ('policy_topics', 'policy_topics'),
+                 ('academic_areas', 'academic_areas'),
+                 ('geographic_regions', 'geographic_regions'),
+                 ('degrees_programs', 'degrees_&_programs'),
+                 ('centers_initiatives', 'centers_&_initiatives'),
+                 ('key_terms', 'key_terms')]
+
+# restricts parsing of KNET event pages to the field labels and values read by `parse_event_data`
+EVENT_FIELDS_STRAINER = SoupStrainer(class_=['ms-standardheader', 'ms-formbody'])
+
+# characters stripped from KNET field values
+FIELD_CLEAN_TABLE = str.maketrans('', '', '\t\n\r\xa0')
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_header(header):
+    """
+    Convert a KNET field label to its event_info key, memoized since every page uses the same labels
+
+    Arguments:
+        header (str): field label text
+
+    Returns:
+        key (str): event_info key for the field
+    """
+    key = header.replace(' ', '_').lower().replace('_(if_any)', '').replace('-', '')
+    return key
+
+
+def iter_batches(iterable, batch_size):
+    """
+    Split an iterable into lists of at most batch_size items without consuming it all up front
 
+    Arguments:
+        iterable (iterable): items to batch
+        batch_size (int): max number of items per batch
 
-class Scraper(object):
+    Returns:
+        batches (generator of lists): consecutive batches of items
     """
-    Class for general purpose scraper that can be applied beyond HKS
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, batch_size))
+
+
+def create_tile_json(event_info):
     """
+    Serialize the tile the website lists an event with, which has to match the website's
+    `models.create_event_tile` apart from the event id, since that isn't known until the event is inserted
+
+    Arguments:
+        event_info (dict): dict returned by `parse_event_data`
+
+    Returns:
+        tile_json (str or None): json of the tile, None if the event has no start or end time
+    """
+    if event_info['start_time'] is None or event_info['end_time'] is None:
+        return None
+    start_time = datetime.datetime.strptime(event_info['start_time'], '%Y-%m-%d %H:%M:%S')
+    end_time = datetime.datetime.strptime(event_info['end_time'], '%Y-%m-%d %H:%M:%S')
+    rsvp_email_url = event_info['rsvp_email_or_url']
+    tile = {
+        'title': event_info['title'],
+        'timing': '{0} - {1} ({2} mins)'.format(start_time.strftime('%I: %M %p'),
+                                                end_time.strftime('%I: %M %p'),
+                                                int((end_time - start_time).seconds / 60)),
+        'location': event_info['location'],
+        'rsvp_required': ((rsvp_email_url.replace(' ', '') if rsvp_email_url else 'Yes')
+                          if event_info['rsvp_required'] else 'No'),
+        'description': event_info['description'],
+        'contact_name': event_info['contact_name'],
+        'contact_email': event_info['contact_email_address'],
+        'ticketed_event_instructions': event_info['ticketed_event_instructions'],
+        'rsvp_date': (datetime.datetime.strptime(event_info['rsvp_date'], '%Y-%m-%d').strftime('%a %b %d')
+                      if event_info['rsvp_date'] else None),
+        'date': start_time.strftime('%a %b %d'),
+    }
+    return json.dumps(tile)
+
+
+# scraper classes keyed by the events.source value they write, filled by `register_scraper`
+SCRAPERS = {}
+
+
+def register_scraper(source):
+    """
+    Class decorator adding a Scraper subclass to SCRAPERS so that `run_scrapers.handler` runs it, raises TypeError
+    if the subclass doesn't implement every abstract method of Scraper
+
+    Arguments:
+        source (str): value written to events.source for events of this scraper
+
+    Returns:
+        decorator (function): registers and returns the class
+    """
+    def decorator(scraper_class):
+        if scraper_class.__abstractmethods__:
+            raise TypeError('Scraper {0} does not implement {1}'.format(
+                scraper_class.__name__, ', '.join(sorted(scraper_class.__abstractmethods__))))
+        scraper_class.source = source
+        SCRAPERS[source] = scraper_class
+        return scraper_class
+    return decorator
+
+
+class SessionExpiredError(Exception):
+    """
+    Raised when a page shows the scraper is no longer logged in
+    """
+
+
+class Scraper(abc.ABC):
+    """
+    Class for general purpose scraper that can be applied beyond HKS, register subclasses with `register_scraper`.
+    Subclasses missing any of the abstract methods fail when they are created
+    """
+    source = None
 
     def __init__(self, config):
         """
@@ -17,104 +176,253 @@ class Scraper(object):
             config (dict): dict of config variables for database
         """
         self.config = config
-        self.events_to_add = []
-        self.pulled_events = set()
+        self.stats = ScrapeStats(self.source)
+
+    @classmethod
+    @abc.abstractmethod
+    def from_environ(cls, config):
+        """
+        Create the scraper from environment variables, implemented by each scraper
+
+        Arguments:
+            config (dict): dict of config variables for database
+
+        Returns:
+            scraper (Scraper): configured scraper
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_events(self):
+        """
+        List the events to scrape without scraping them, implemented by each scraper to support sharded runs
 
-    def reset(self):
+        Returns:
+            links (dict): event links keyed by source id, in the format accepted by `scrape_new_events`
         """
-        Reset scraper
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def parse_event_page(self, event_html):
         """
-        self.events_to_add = []
-        self.pulled_events = set()
+        Parse the html of an individual event page, implemented by each scraper so archived pages can be re-parsed
+
+        Arguments:
+            event_html (str): html of event page
 
-    def get_pulled_events(self):
+        Returns:
+            event_info (dict): dict in the format returned by `HKSScraper.parse_event_data`
         """
-        Get events that have already been scraped so that the scraper doesn't add to the database again
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def scrape_new_events(self, links=None):
         """
-        # create cursor
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
+        Scrape events from the source, implemented by each scraper. Failures on individual events should be
+        counted in the `errors` counter of self.stats and skipped. To archive the page an event was parsed from,
+        set the event's archived_page key to a (fetched_at, html) tuple
 
-        # set filter date to previous date
-        filter_date = datetime.datetime.today() - datetime.timedelta(days=1)
+        Arguments:
+            links (dict): subset of `list_events` to scrape, None to list and scrape every event
 
-        # execute query and get ids of events already scraped with a start time after yesterday
-        cursor.execute("select source_id from events where start_time >= %s", (filter_date, ))
-        self.pulled_events = set(event[0] for event in cursor)
-        cursor.close()
-        conn.close()
+        Returns:
+            events (generator of dicts): dicts in the format returned by `HKSScraper.parse_event_data`
+        """
+        raise NotImplementedError
 
-    def add_events_to_db(self):
+    def export_session(self):
         """
-        Add new event or update existing event in db
+        Get the logged in session of the last run, so that the shards of a sharded run reuse the coordinator's
+        login instead of each logging in. Scrapers without a login return None
 
         Returns:
-            events_log (str): describes number of events added to the db on a specific day
+            session_state (json serializable or None): state accepted by `restore_session`
+        """
+        return None
+
+    def restore_session(self, session_state):
+        """
+        Reuse a session exported by `export_session` in the next run, scrapers without a login ignore it
+
+        Arguments:
+            session_state (json serializable or None): state returned by `export_session`
+        """
+
+    def connect_to_db(self):
+        """
+        Open a connection to the events database
+
+        Returns:
+            conn (mysql.connector.MySQLConnection): connection with FOUND_ROWS set, which makes the affected row
+                count of an upsert 1 for unchanged rows and 2 for changed rows
+        """
+        conn = mysql.connector.connect(client_flags=[ClientFlag.FOUND_ROWS], **self.config)
+        return conn
+
+    def create_content_hash(self, event_info):
+        """
+        Fingerprint the normalized event so unchanged events can be skipped on update
+
+        Arguments:
+            event_info (dict): dict returned by `parse_event_data`
+
+        Returns:
+            content_hash (str): sha1 hex digest of the event
+        """
+        event_json = json.dumps(event_info, sort_keys=True, default=str)
+        content_hash = hashlib.sha1(event_json.encode('utf-8')).hexdigest()
+        return content_hash
+
+    def archive_event_pages(self, cursor, archived_pages):
+        """
+        Compress event pages into the event_page_archive table, skipping pages whose html is byte for byte the
+        same as the latest archived copy. The hash is of the raw html rather than the parsed content hash, since
+        the archive exists to re-parse content the parser may have missed
+
+        Arguments:
+            cursor (mysql.connector.cursor.MySQLCursor): cursor of the transaction of the batch
+            archived_pages (list of tuples): (source id, fetched_at, utf-8 html) of each page
+        """
+        html_hashes = {source_id: hashlib.sha1(html).hexdigest() for source_id, _, html in archived_pages}
+        cursor.execute('select archive.source_id, archive.html_hash from event_page_archive archive '
+                       'join (select source_id, max(fetched_at) fetched_at from event_page_archive '
+                       '      where source = %s and source_id in ({0}) group by source_id) latest '
+                       'on archive.source_id = latest.source_id and archive.fetched_at = latest.fetched_at '
+                       'where archive.source = %s'.format(', '.join(['%s'] * len(html_hashes))),
+                       [self.source] + list(html_hashes) + [self.source])
+        latest_hashes = dict(cursor.fetchall())
+
+        archive_params = []
+        for source_id, fetched_at, html in archived_pages:
+            if latest_hashes.get(source_id) != html_hashes[source_id]:
+                archive_params.extend([self.source, source_id, fetched_at, zlib.compress(html),
+                                       html_hashes[source_id]])
+        if archive_params:
+            archive_rows = ', '.join(['(%s, %s, %s, %s, %s)'] * (len(archive_params) // 5))
+            cursor.execute('insert into event_page_archive (source, source_id, fetched_at, html, html_hash) '
+                           'VALUES {0}'.format(archive_rows), archive_params)
+        self.stats.increment('pages_archived', len(archive_params) // 5)
+
+    def add_events_to_db(self, events, batch_size=100):
+        """
+        Add new events or update changed events in db, using chunked multi-row upserts keyed on the unique
+        `scraped_source_id` column (see migrations/001_add_unique_scraped_source_id.sql). Each chunk is committed
+        as soon as it's written so an interrupted run keeps the events written so far. Pages of events with an
+        archived_page are archived (see `archive_event_pages`), and the events version the website
+        caches upcoming events by is bumped if the chunk changed anything, in the same transaction
+
+        Arguments:
+            events (iterable of dicts): events to write, consumed lazily
+            batch_size (int): number of events written and committed per insert statement
+
+        Returns:
+            events_log (str): describes number of events added, changed and unchanged in the db on a specific day
         """
 
         # initialize connector
-        conn = mysql.connector.connect(**self.config)
-        cursor = conn.cursor()
-
-        # sql template to add event
-        add_event = ('insert into events (source, source_id, title, short_description, speaker, sponsor, co_sponsor,'
-                     'additional_sponsor, start_time, end_time, event_type, location, description, intranet_homepage,'
-                     'public_site, hks_today_email, ticketed_event, ticketed_event_instructions, ad_day_one, ad_day_two,'
-                     'contact_name, contact_email, phone_number, rsvp_required, rsvp_date, rsvp_email_url, existing_website,'
-                     'policy_topics, academic_areas, geographic_regions, degrees_programs, centers_initiatives, key_terms, date_added)'
-                     'VALUES ("hks", %(source_id)s, %(title)s, %(short_description)s, %(speaker)s, %(sponsor)s, %(cosponsors)s,'
-                     '%(additional_sponsors)s, %(start_time)s, %(end_time)s, %(event_type)s, %(location)s, %(description)s, %(intranet_home_page)s,'
-                     '%(public_site)s, %(hks_today_email)s, %(ticketed_event)s, %(ticketed_event_instructions)s, %(advertisement_day_1)s, %(advertisement_day_2)s,'
-                     '%(contact_name)s, %(contact_email_address)s, %(phone_number)s, %(rsvp_required)s, %(rsvp_date)s, %(rsvp_email_or_url)s, %(link_to_an_existing_website)s,'
-                     '%(policy_topics)s, %(academic_areas)s, %(geographic_regions)s, %(degrees_&_programs)s, %(centers_&_initiatives)s, %(key_terms)s, %(date_added)s)')
-
-        # sql template to update event
-        update_event = ('update events set title=%(title)s, short_description=%(short_description)s, speaker=%(speaker)s, sponsor=%(sponsor)s, co_sponsor=%(cosponsors)s,'
-                        'additional_sponsor=%(additional_sponsors)s, start_time=%(start_time)s, end_time=%(end_time)s, event_type=%(event_type)s, location=%(location)s, description=%(description)s, intranet_homepage=%(intranet_home_page)s,'
-                        'public_site=%(public_site)s, hks_today_email=%(hks_today_email)s, ticketed_event=%(ticketed_event)s, ticketed_event_instructions=%(ticketed_event_instructions)s, ad_day_one=%(advertisement_day_1)s, ad_day_two=%(advertisement_day_2)s,'
-                        'contact_name=%(contact_name)s, contact_email=%(contact_email_address)s, phone_number=%(phone_number)s, rsvp_required=%(rsvp_required)s, rsvp_date=%(rsvp_date)s, rsvp_email_url=%(rsvp_email_or_url)s, existing_website=%(link_to_an_existing_website)s,'
-                        'policy_topics=%(policy_topics)s, academic_areas=%(academic_areas)s, geographic_regions=%(geographic_regions)s, degrees_programs=%(degrees_&_programs)s, centers_initiatives=%(centers_&_initiatives)s, key_terms=%(key_terms)s'
-                        ' where source_id=%(source_id)s')
-
-        new_additions_counter = 0
-        for event in self.events_to_add:
-
-            # update existing event
-            if event['source_id'] in self.pulled_events:
-                cursor.execute(update_event, event)
-            # add new event
-            else:
-                print(event)
-                event["date_added"] = str(datetime.datetime.today()).split('.')[0]
-                cursor.execute(add_event, event)
-                new_additions_counter += 1
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-        events_log = '{0}: {1} Events Added to DB'.format(datetime.datetime.today(), new_additions_counter)
+        with self.stats.timer('db'):
+            conn = self.connect_to_db()
+            cursor = conn.cursor()
+
+        # date_added is only written on insert, so it doubles as a marker for the events this run added
+        date_added = str(datetime.datetime.today()).split('.')[0]
+
+        # sql template to add events, when the source_id already exists every column but date_added is updated
+        # unless the content hash matches, in which case the row is left untouched (content_hash has to be
+        # assigned last since mysql applies the assignments in order). tile_json is also filled in for events
+        # written before it was materialized
+        columns = ', '.join(['source'] + [column for column, _ in EVENT_COLUMNS] +
+                            ['tile_json', 'content_hash', 'date_added'])
+        row_template = '(%s, {0}, %s, %s, %s)'.format(', '.join(['%s'] * len(EVENT_COLUMNS)))
+        updates = ', '.join(['{0}=if(content_hash <=> VALUES(content_hash), {0}, VALUES({0}))'.format(column)
+                             for column, _ in EVENT_COLUMNS if column != 'source_id'] +
+                            ['tile_json=if(content_hash <=> VALUES(content_hash) and tile_json is not null, '
+                             'tile_json, VALUES(tile_json))',
+                             'content_hash=VALUES(content_hash)'])
+
+        try:
+            events_counter = 0
+            affected_rows = 0
+            new_additions_counter = 0
+            for batch in iter_batches(events, batch_size):
+                upsert_events = 'insert into events ({0}) VALUES {1} on duplicate key update {2}'.format(
+                    columns, ', '.join([row_template] * len(batch)), updates)
+                params = []
+                archived_pages = []
+                for event in batch:
+                    archived_page = event.pop('archived_page', None)
+                    if archived_page is not None:
+                        fetched_at, html = archived_page
+                        archived_pages.append((event['source_id'], fetched_at, html.encode('utf-8')))
+                    params.append(self.source)
+                    params.extend(event[key] for _, key in EVENT_COLUMNS)
+                    params.append(create_tile_json(event))
+                    params.append(self.create_content_hash(event))
+                    params.append(date_added)
+                with self.stats.timer('db'):
+                    cursor.execute(upsert_events, params)
+                    batch_affected_rows = cursor.rowcount
+                    affected_rows += batch_affected_rows
+
+                    # count the rows of the batch inserted by this run, restricted to the batch so concurrent
+                    # shards of the same run don't count each other's inserts
+                    cursor.execute('select count(*) from events where scraped_source_id in ({0}) and date_added = %s'
+                                   .format(', '.join(['%s'] * len(batch))),
+                                   [event['source_id'] for event in batch] + [date_added])
+                    batch_new_additions = cursor.fetchone()[0]
+                    new_additions_counter += batch_new_additions
+
+                    # invalidate the website's cache of upcoming events if the batch added or changed any
+                    if batch_new_additions or batch_affected_rows > len(batch):
+                        cursor.execute("insert into cache_versions (name, version) VALUES ('events', 1) "
+                                       "on duplicate key update version = version + 1")
+
+                    if archived_pages:
+                        self.archive_event_pages(cursor, archived_pages)
+                    conn.commit()
+                events_counter += len(batch)
+        finally:
+            cursor.close()
+            conn.close()
+
+        # with FOUND_ROWS every row counts once in the affected rows, and changed rows count once more
+        changed_counter = affected_rows - events_counter
+        unchanged_counter = events_counter - new_additions_counter - changed_counter
+        self.stats.increment('inserts', new_additions_counter)
+        self.stats.increment('updates', changed_counter)
+        self.stats.increment('unchanged', unchanged_counter)
+
+        events_log = '{0}: {1} Events Added to DB, {2} Changed, {3} Unchanged'.format(
+            datetime.datetime.today(), new_additions_counter, changed_counter, unchanged_counter)
         return events_log
 
-    def get_new_events(self):
+    def get_new_events(self, links=None):
         """
-        Main function to call on scraper class
+        Main function to call on scraper class, streams scraped events into the db
+
+        Arguments:
+            links (dict): subset of `list_events` to scrape, None to list and scrape every event
 
         Returns:
-            events_log (str): describes number of events added to the db on a specific day
+            record (dict): `ScrapeStats.to_dict` record of the run, with the events_log describing number of events
+                added to the db on a specific day
         """
-        self.get_pulled_events()
-        self.scrape_new_events()
-        events_log = self.add_events_to_db()
-        self.reset()
-        return events_log
+        self.stats = ScrapeStats(self.source)
+        with self.stats.timer('total'):
+            events_log = self.add_events_to_db(self.scrape_new_events(links))
+        record = self.stats.to_dict()
+        record['events_log'] = events_log
+        return record
 
 
+@register_scraper('hks')
 class HKSScraper(Scraper):
     """
     Scraper specifically for HKS events
     """
 
-    def __init__(self, username, password, config):
+    def __init__(self, username, password, config, max_workers=8, fast_parse=True, cache=None, replay=False,
+                 scheduler_options=None, session_store=None, archive_pages=False):
         """
         Initialize hks scraper
 
@@ -122,8 +430,33 @@ class HKSScraper(Scraper):
             username (str): KNET (HKS Intranet) username
             password (pword): KNET (HKS Intranet) password
             config (dict): dict of config variables for database
+            max_workers (int): max number of event pages fetched concurrently, 1 fetches serially
+            fast_parse (bool): only build the parts of event pages read by `parse_event_data`
+            cache (http_cache.ResponseCache): cache of KNET pages, None to always fetch pages in full
+            replay (bool): read every page from the cache without logging in or touching the network
+            scheduler_options (dict): keyword arguments for the `http_scheduler.RequestScheduler` that sends all
+                KNET requests, e.g. max_requests_per_second or read_timeout
+            session_store (session_store.SessionStore): store of logged in cookies reused across runs, None to log
+                in on every run
+            archive_pages (bool): store the html of fetched event pages that changed since they were last archived
+                in the event_page_archive table, see backfill.py
         """
         super().__init__(config)
+        if replay and cache is None:
+            raise ValueError('Replay mode requires a response cache')
+        self.max_workers = max(1, max_workers)
+        self.fast_parse = fast_parse
+        self.cache = cache
+        self.replay = replay
+        self.scheduler_options = scheduler_options or {}
+        self.session_store = session_store
+        self.archive_pages = archive_pages
+
+        # cookies of the logged in session, restored on login if set (e.g. by a coordinator) and updated by every
+        # login. Logins are counted so that threads finding the session expired together log in once
+        self.session_cookies = None
+        self.login_lock = threading.Lock()
+        self.login_count = 0
         self.base_url = 'https://knet.hks.harvard.edu/CookieAuth.dll?Logon'
         self.events_url = "https://knet.hks.harvard.edu/Pages/AllEvents.aspx"
 
@@ -140,6 +473,37 @@ class HKSScraper(Scraper):
             'SubmitCreds': 'Log On',
         }
 
+    @classmethod
+    def from_environ(cls, config):
+        """
+        Create the hks scraper from KNET_* environment variables
+
+        Arguments:
+            config (dict): dict of config variables for database
+
+        Returns:
+            scraper (HKSScraper): configured scraper
+        """
+        cache_path = os.environ.get('KNET_CACHE_PATH')
+        session_secret = os.environ.get('KNET_SESSION_SECRET', os.environ.get('KNET_PASSWORD'))
+        session_store = (SessionStore(os.environ.get('KNET_SESSION_PATH', '/tmp/knet_session'),
+                                      session_secret,
+                                      ttl=int(os.environ.get('KNET_SESSION_TTL', '1800')))
+                         if session_secret else None)
+        scraper = cls(os.environ.get('KNET_USERNAME'),
+                      os.environ.get('KNET_PASSWORD'),
+                      config,
+                      max_workers=int(os.environ.get('KNET_MAX_WORKERS', '8')),
+                      cache=ResponseCache(cache_path) if cache_path else None,
+                      replay=(os.environ.get('KNET_REPLAY', '') == 'true'),
+                      scheduler_options={
+                          'max_requests_per_second': float(os.environ.get('KNET_REQUESTS_PER_SECOND', '20')),
+                          'read_timeout': float(os.environ.get('KNET_READ_TIMEOUT', '30')),
+                      },
+                      session_store=session_store,
+                      archive_pages=(os.environ.get('KNET_ARCHIVE_PAGES', 'true') == 'true'))
+        return scraper
+
     def parse_event_data(self, event_soup):
         """
         Parse the html of an individual event on KNET
@@ -186,13 +550,13 @@ class HKSScraper(Scraper):
         field_headers = [field.text for field in event_soup.findAll('h3', {'class': 'ms-standardheader'})]
 
         # get the field values
-        fields_clean = [field.text.replace('\t', '').replace('\n', '').replace('\r', '').replace('\xa0', '')
+        fields_clean = [field.text.translate(FIELD_CLEAN_TABLE)
                         for field in event_soup.findAll('td', {'class': 'ms-formbody'})]
 
         # loop through headers and fields, adding to dict and setting value to None if blank
         event_info = {}
         for header, field in zip(field_headers, fields_clean):
-            header = header.replace(' ', '_').lower().replace('_(if_any)', '').replace('-', '')
+            header = normalize_header(header)
             if field == '':
                 field = None
             event_info[header] = field
@@ -229,6 +593,24 @@ class HKSScraper(Scraper):
                                                                 '%m/%d/%Y %I:%M %p').strftime('%Y-%m-%d %H:%M:00')
         return event_info
 
+    def parse_event_page(self, event_html):
+        """
+        Build the soup of an individual event page and parse it
+
+        Arguments:
+            event_html (str): html of event page
+
+        Returns:
+            event_info (dict): dict with event labels and corresponding values
+        """
+        with self.stats.timer('parse'):
+            if self.fast_parse:
+                event_soup = BeautifulSoup(event_html, 'html.parser', parse_only=EVENT_FIELDS_STRAINER)
+            else:
+                event_soup = BeautifulSoup(event_html, 'html.parser')
+            event_info = self.parse_event_data(event_soup)
+        return event_info
+
     def create_event_source_id(self, event_url):
         """
         Create the unique id for the event
@@ -245,27 +627,288 @@ class HKSScraper(Scraper):
         formatted_id = org_header + '-' + id_number
         return formatted_id
 
-    def scrape_new_events(self):
+    def get_page(self, session, url):
+        """
+        Get the html of a KNET page, logging in again and retrying once if the session has expired
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the logged in KNET session
+            url (str): url of page
+
+        Returns:
+            html (str): html of page
+
+        Raises:
+            SessionExpiredError: if the page still redirects to the login page after logging in again
+        """
+        if self.replay:
+            return self.cache.replay(url)
+        login_count = self.login_count
+        try:
+            return self.request_page(session, url)
+        except SessionExpiredError:
+            self.renew_login(session, login_count)
+            return self.request_page(session, url)
+
+    def request_page(self, session, url):
         """
-        Scrapes all events from HKS main events page
+        Request a KNET page, going through the response cache if there is one
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the logged in KNET session
+            url (str): url of page
+
+        Returns:
+            html (str): html of page
+
+        Raises:
+            SessionExpiredError: if KNET redirected the request to its login page, see `check_login_redirect`
+        """
+        if self.cache is not None:
+            return self.cache.get(session, url)
+        return session.get(url).text
+
+    def check_login_redirect(self, response, *args, **kwargs):
+        """
+        Response hook of KNET sessions raising SessionExpiredError when a page request lands on the login page, so
+        that the login form is neither parsed as an event nor cached
+
+        Arguments:
+            response (requests.Response): response of a request, or of one of its redirects
+        """
+        if response.request.method == 'GET' and 'CookieAuth.dll' in response.url:
+            url = response.history[0].url if response.history else response.url
+            # release the connection to the pool, the body of the login page is never read
+            response.close()
+            raise SessionExpiredError('{0} redirected to the login page'.format(url))
+
+    def renew_login(self, session, login_count):
+        """
+        Log in again after a request found the session expired, unless another thread already did
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the expired session
+            login_count (int): value of self.login_count when the expired request was sent
+        """
+        with self.login_lock:
+            if self.login_count == login_count:
+                self.stats.increment('sessions_renewed')
+                self.login(session, force=True)
+
+    def fetch_event_page(self, session, event_url):
+        """
+        Fetch the html of an individual event page, safe to call from worker threads
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the logged in KNET session
+            event_url (str): url of event page
+
+        Returns:
+            html (str): html of event page
+        """
+        start = time.perf_counter()
+        html = self.get_page(session, event_url)
+        self.stats.add_page_latency(time.perf_counter() - start)
+        self.stats.increment('pages_fetched')
+        return html
+
+    def login(self, session, force=False):
+        """
+        Log in to KNET, storing the auth cookies on the session. Cookies restored with `restore_session`, or
+        unexpired cookies of an earlier login in the session store, are reused instead, and the cookies of a new
+        login are stored
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the session to log in
+            force (bool): log in even if there are reusable cookies, e.g. because they were rejected
+        """
+        with self.stats.timer('login'):
+            if not force and self.session_cookies is not None:
+                restore_cookies(session.cookies, self.session_cookies)
+                self.stats.increment('sessions_reused')
+            elif self.session_store is None:
+                session.post(self.base_url, self.payload)
+            else:
+                # hold the store lock while logging in so concurrent scrapers wait for this login instead of
+                # repeating it
+                with self.session_store.lock():
+                    if not force and self.session_store.load(session.cookies):
+                        self.stats.increment('sessions_reused')
+                    else:
+                        session.post(self.base_url, self.payload)
+                        self.session_store.save(session.cookies)
+            self.session_cookies = serialize_cookies(session.cookies)
+            self.login_count += 1
+
+    def get_event_links(self, session):
+        """
+        Get the links to every event on the HKS main events page
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the logged in KNET session
+
+        Returns:
+            links (dict): event page urls keyed by source id
+        """
+        # get soup of page
+        with self.stats.timer('listing'):
+            main_events_page = self.get_page(session, self.events_url)
+        main_event_soup = BeautifulSoup(main_events_page, 'html.parser')
+
+        # extract table with all events, missing if KNET sent the login page instead
+        main_events_table = main_event_soup.find("div", {"id": "WebPartWPQ7"})
+        if main_events_table is None:
+            raise SessionExpiredError('Events page requires login')
+
+        # get links to all events
+        raw_links = [a['href'] for a in main_events_table.findAll("a")]
+        links = {self.create_event_source_id(link): link for link in raw_links}
+        return links
+
+    def fetch_event_pages(self, session, links):
+        """
+        Fetch event pages on a worker pool sharing the logged in cookie jar, keeping at most two pages per worker
+        in flight so memory doesn't grow with the number of events
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the logged in KNET session
+            links (dict): event page urls keyed by source id
+
+        Returns:
+            event_pages (generator of tuples): (source id, html) in link order, html is None if the fetch failed
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for link_id, link in links.items():
+                pending.append((link_id, executor.submit(self.fetch_event_page, session, link)))
+                if len(pending) >= 2 * self.max_workers:
+                    yield self.wait_for_event_page(*pending.popleft())
+            while pending:
+                yield self.wait_for_event_page(*pending.popleft())
+
+    def wait_for_event_page(self, link_id, future):
+        """
+        Wait for an event page fetched on the worker pool, counting and logging a failed fetch
+
+        Arguments:
+            link_id (str): source id of event
+            future (concurrent.futures.Future): future of `fetch_event_page`
+
+        Returns:
+            event_page (tuple): (source id, html), html is None if the fetch failed
+        """
+        try:
+            return link_id, future.result()
+        # KNET is down or rejects a fresh login, stop the run rather than failing every page
+        except (CircuitOpenError, SessionExpiredError):
+            raise
+        except Exception as error:
+            self.stats.increment('errors')
+            print('Failed to fetch {0}: {1!r}'.format(link_id, error))
+            return link_id, None
+
+    @contextlib.contextmanager
+    def open_session(self):
+        """
+        Open a KNET session wrapped in a RequestScheduler, which throttles, times out and retries every request and
+        stops the run if KNET is down
+
+        Returns:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the new session
         """
         with requests.Session() as session:
-            # get soup of page
-            session.post(self.base_url, self.payload)
-            main_events_page = session.get(self.events_url)
-            main_event_soup = BeautifulSoup(main_events_page.text, 'html.parser')
-
-            # extract table with all events
-            main_events_table = main_event_soup.find("div", {"id": "WebPartWPQ7"})
-
-            # get links to all events
-            raw_links = [a['href'] for a in main_events_table.findAll("a")]
-            links = {self.create_event_source_id(link): link for link in raw_links}
-
-            # get data for each event in the link
-            for link_id in links:
-                event_page = session.get(links[link_id])
-                event_soup = BeautifulSoup(event_page.text, 'html.parser')
-                event_info = self.parse_event_data(event_soup)
+            # size the connection pool so concurrent fetches don't discard connections
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            # raise SessionExpiredError instead of returning the login page when the cookies expire
+            session.hooks['response'].append(self.check_login_redirect)
+
+            scheduler_options = dict({'max_concurrency': self.max_workers}, **self.scheduler_options)
+            scheduler = RequestScheduler(session, **scheduler_options)
+            try:
+                yield scheduler
+            finally:
+                self.stats.increment('bytes_downloaded', scheduler.bytes_downloaded)
+                self.stats.increment('retries', scheduler.retries)
+
+    def start_session(self, session, get_links=True):
+        """
+        Log in and get the event links. Reused cookies aren't checked up front, a request redirected to the login
+        page logs in again and is retried (see `get_page`)
+
+        Arguments:
+            session (http_scheduler.RequestScheduler): scheduler sending requests on the session to log in
+            get_links (bool): whether the event links are needed
+
+        Returns:
+            links (dict or None): event page urls keyed by source id, None if not fetched
+        """
+        if not self.replay:
+            self.login(session)
+        if not get_links:
+            return None
+        links = self.get_event_links(session)
+        return links
+
+    def export_session(self):
+        """
+        Get the cookies of the last login, see `Scraper.export_session`
+
+        Returns:
+            session_cookies (list of dicts or None): cookies returned by `session_store.serialize_cookies`, None if
+                the scraper hasn't logged in
+        """
+        return self.session_cookies
+
+    def restore_session(self, session_state):
+        """
+        Reuse the cookies of another scraper's login, see `Scraper.restore_session`
+
+        Arguments:
+            session_state (list of dicts or None): cookies returned by `export_session`
+        """
+        if session_state is not None:
+            self.session_cookies = session_state
+
+    def list_events(self):
+        """
+        Get the links to every event on the HKS main events page in a session of its own
+
+        Returns:
+            links (dict): event page urls keyed by source id
+        """
+        with self.open_session() as session:
+            links = self.start_session(session)
+        return links
+
+    def scrape_new_events(self, links=None):
+        """
+        Scrapes all events from HKS main events page, or the given subset of them
+
+        Arguments:
+            links (dict): event page urls keyed by source id, None to scrape every event on the main events page
+
+        Returns:
+            events (generator of dicts): event info of each event, parsed as its page arrives
+        """
+        with self.open_session() as session:
+            listed_links = self.start_session(session, get_links=(links is None))
+            if links is None:
+                links = listed_links
+
+            # parse each page in this thread while the workers fetch the next ones
+            for link_id, event_page in self.fetch_event_pages(session, links):
+                if event_page is None:
+                    continue
+                try:
+                    event_info = self.parse_event_page(event_page)
+                except Exception as error:
+                    self.stats.increment('errors')
+                    print('Failed to parse {0}: {1!r}'.format(link_id, error))
+                    continue
                 event_info['source_id'] = link_id
-                self.events_to_add.append(event_info)
+                if self.archive_pages:
+                    event_info['archived_page'] = (str(datetime.datetime.today()).split('.')[0], event_page)
+                yield event_info
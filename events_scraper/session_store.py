@@ -0,0 +1,112 @@
+import base64
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+from cryptography.fernet import Fernet, InvalidToken
+
+
+def serialize_cookies(cookies):
+    """
+    Convert cookies to json serializable dicts, e.g. to store them or to pass them to another process
+
+    Arguments:
+        cookies (requests.cookies.RequestsCookieJar): cookies of a session
+
+    Returns:
+        serialized_cookies (list of dicts): name, value, domain, path, secure and expires of each cookie
+    """
+    serialized_cookies = [{'name': cookie.name,
+                           'value': cookie.value,
+                           'domain': cookie.domain,
+                           'path': cookie.path,
+                           'secure': cookie.secure,
+                           'expires': cookie.expires} for cookie in cookies]
+    return serialized_cookies
+
+
+def restore_cookies(cookies, serialized_cookies):
+    """
+    Restore cookies serialized by `serialize_cookies`
+
+    Arguments:
+        cookies (requests.cookies.RequestsCookieJar): cookie jar to restore into
+        serialized_cookies (list of dicts): cookies returned by `serialize_cookies`
+    """
+    for cookie in serialized_cookies:
+        cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'],
+                    secure=cookie['secure'], expires=cookie['expires'])
+
+
+class SessionStore(object):
+    """
+    Encrypted file store for the cookies of a logged in KNET session, so that runs in the same container (and
+    concurrent scraper processes) reuse one login until it expires
+    """
+
+    def __init__(self, path, secret, ttl=1800):
+        """
+        Initialize store
+
+        Arguments:
+            path (str): path of the cookie file, e.g. under /tmp on lambda
+            secret (str): secret the encryption key is derived from, e.g. the KNET password
+            ttl (int): seconds stored cookies are trusted for
+        """
+        self.path = path
+        self.ttl = ttl
+        key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode('utf-8')).digest())
+        self.fernet = Fernet(key)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Hold an exclusive lock on the store across processes, so only one of them logs in at a time
+        """
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, cookies):
+        """
+        Restore stored cookies if they exist and have not expired
+
+        Arguments:
+            cookies (requests.cookies.RequestsCookieJar): cookie jar to restore into
+
+        Returns:
+            restored (bool): whether cookies were restored
+        """
+        try:
+            with open(self.path, 'rb') as store_file:
+                token = store_file.read()
+            stored_cookies = json.loads(self.fernet.decrypt(token, ttl=self.ttl).decode('utf-8'))
+        except (OSError, InvalidToken, ValueError):
+            return False
+        restore_cookies(cookies, stored_cookies)
+        return True
+
+    def save(self, cookies):
+        """
+        Store cookies, encrypted and readable only by the current user
+
+        Arguments:
+            cookies (requests.cookies.RequestsCookieJar): cookies of the logged in session
+        """
+        token = self.fernet.encrypt(json.dumps(serialize_cookies(cookies)).encode('utf-8'))
+        temp_path = self.path + '.tmp'
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as store_file:
+            store_file.write(token)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """
+        Remove stored cookies
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
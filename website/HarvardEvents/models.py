@@ -1,10 +1,83 @@
 from flask_login import UserMixin
+from sqlalchemy.dialects.mysql import MEDIUMTEXT
+import collections
 import datetime
+import json
 from HarvardEvents import db
 
+# tile of an event shown in listings, see `create_event_tile`
+EventTile = collections.namedtuple('EventTile', ['event_id', 'title', 'timing', 'location', 'rsvp_required',
+                                                 'description', 'contact_name', 'contact_email',
+                                                 'ticketed_event_instructions', 'rsvp_date', 'date'])
+
+
+def create_event_tile(event):
+    """
+    Create the tile of an event, formatting its times and rsvp once
+
+    Arguments:
+        event (Event or row): event, or a row with the columns of `Event.tile_columns`
+
+    Returns:
+        tile (EventTile): tile of the event
+    """
+    return EventTile(
+        event_id=event.id,
+        title=event.title,
+        timing='{0} - {1} ({2} mins)'.format(event.start_time.strftime('%I: %M %p'),
+                                             event.end_time.strftime('%I: %M %p'),
+                                             int((event.end_time - event.start_time).seconds / 60)),
+        location=event.location,
+        rsvp_required=((event.rsvp_email_url.replace(' ', '') if event.rsvp_email_url else 'Yes')
+                       if event.rsvp_required else 'No'),
+        description=event.description,
+        contact_name=event.contact_name,
+        contact_email=event.contact_email,
+        ticketed_event_instructions=event.ticketed_event_instructions,
+        rsvp_date=(event.rsvp_date.strftime('%a %b %d') if event.rsvp_date else None),
+        date=event.start_time.strftime('%a %b %d'),
+    )
+
+
+def create_tile_json(event):
+    """
+    Serialize the tile of an event for the tile_json column, without the event id so that the scrapers can write
+    it before the event is inserted (see `create_tile_json` of events_scraper/scrapers.py)
+
+    Arguments:
+        event (Event): event, with its times loaded from the db
+
+    Returns:
+        tile_json (str): json of the tile
+    """
+    tile = create_event_tile(event)._asdict()
+    del tile['event_id']
+    return json.dumps(tile)
+
+
+def load_event_tile(event_id, tile_json):
+    """
+    Load a tile serialized by `create_tile_json`
+
+    Arguments:
+        event_id (int): id of the event
+        tile_json (str): json of the tile
+
+    Returns:
+        tile (EventTile): tile of the event
+    """
+    return EventTile(event_id=event_id, **json.loads(tile_json))
+
 
 class Event(db.Model):
     __tablename__ = 'events'
+    __table_args__ = (
+        # serves the search in `query_helpers.get_event_tiles`
+        db.Index('ix_events_search', 'description', 'title', 'policy_topics', 'academic_areas', 'geographic_regions',
+                 'degrees_programs', 'centers_initiatives', mysql_prefix='FULLTEXT'),
+        # serves the submitted events of `query_helpers.get_user_events`
+        db.Index('ix_events_source_id_start_time', 'source_id', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     title = db.Column(db.String(256), nullable=False)
@@ -38,28 +111,22 @@ class Event(db.Model):
     degrees_programs = db.Column(db.String(256))
     centers_initiatives = db.Column(db.String(256))
     key_terms = db.Column(db.String(256))
-    source = db.Column(db.Enum('hks', 'user'), nullable=False)
+    source = db.Column(db.String(32), nullable=False)
     source_id = db.Column(db.String(256), nullable=False)
     date_added = db.Column(db.DateTime, default=datetime.datetime.today())
+    tile_json = db.Column(db.Text().with_variant(MEDIUMTEXT(), 'mysql'))
+
+    @classmethod
+    def tile_columns(cls):
+        """
+        Columns read by `create_event_tile`, to query tiles without loading whole events
+        """
+        return [cls.id, cls.title, cls.start_time, cls.end_time, cls.location, cls.rsvp_required, cls.rsvp_email_url,
+                cls.description, cls.contact_name, cls.contact_email, cls.ticketed_event_instructions, cls.rsvp_date]
 
     @property
     def get_tile_data(self):
-        return {
-            'event_id': self.id,
-            'title': self.title,
-            'timing': '{0} - {1} ({2} mins)'.format(self.start_time.strftime('%I: %M %p'),
-                                                    self.end_time.strftime('%I: %M %p'),
-                                                    int((self.end_time - self.start_time).seconds / 60)),
-            'location': self.location,
-            'rsvp_required': ((self.rsvp_email_url.replace(' ', '') if self.rsvp_email_url else 'Yes')
-                              if self.rsvp_required else 'No'),
-            'description': self.description,
-            'contact_name': self.contact_name,
-            'contact_email': self.contact_email,
-            'ticketed_event_instructions': self.ticketed_event_instructions,
-            'rsvp_date': (self.rsvp_date.strftime('%a %b %d') if self.rsvp_date else None),
-            'date': self.start_time.strftime('%a %b %d'),
-        }
+        return create_event_tile(self)._asdict()
 
     @property
     def google_calendar_event(self):
@@ -114,6 +181,10 @@ class Event(db.Model):
 
 class EventSelection(db.Model):
     __tablename__ = 'selected_events'
+    __table_args__ = (
+        # serves `query_helpers.user_selected_events_subquery` from the index alone
+        db.Index('ix_selected_events_user_type_event', 'user_id', 'selection_type', 'event_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     user_id = db.Column(db.String(50), db.ForeignKey('users.id'), nullable=False)
@@ -152,3 +223,36 @@ class User(db.Model, UserMixin):
     @property
     def to_csv(self):
         return '{0.id},{0.created_at}\n'.format(self)
+
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(50), primary_key=True, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CalendarJob(db.Model):
+    __tablename__ = 'calendar_jobs'
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    user_id = db.Column(db.String(50), db.ForeignKey('users.id'), nullable=False)
+    event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable=False)
+    selection_source = db.Column(db.String(32), nullable=False)
+    batch_id = db.Column(db.String(32), index=True)
+    claim_id = db.Column(db.String(32), index=True)
+    status = db.Column(db.Enum('pending', 'running', 'done', 'failed'), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @property
+    def status_data(self):
+        return {
+            'job_id': self.id,
+            'event_id': self.event_id,
+            'status': self.status,
+            'error': self.error,
+        }
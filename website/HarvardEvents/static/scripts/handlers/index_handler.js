@@ -1,13 +1,91 @@
 
-function display_index_page(current_user_authentication, data_raw, scroll) {
+// cursor of the next page of events, null once every event has been loaded
+var next_cursor = null;
+var loading_events = false;
+// ids of the events the user has added to their calendar, pages of upcoming events are the same for every user
+var selected_event_ids = {};
+
+function display_index_page(current_user_authentication, data_raw, scroll, calendar_job_url) {
 	user_signed_in = (current_user_authentication == 'True');
 	create_navbar(user_signed_in, null);
+	next_cursor = data_raw['next_cursor'];
+	data_raw['selected_event_ids'].forEach(function (event_id) { selected_event_ids[event_id] = true; });
 	process_event_data(data_raw);
 	$("[data-toggle=tooltip").tooltip();
 	setTimeout(function () { $("#success-alert").hide()}, 2000);
 	if (scroll != 'None') {
-		document.getElementById(scroll).scrollIntoView();
+		scroll_to_event(scroll);
+	}
+	if (calendar_job_url != 'None') {
+		poll_calendar_job(calendar_job_url);
+	}
+	$(window).on("scroll", function () {
+		if ($(window).scrollTop() + $(window).height() > $(document).height() - 1000) {
+			load_more_events(null);
+		}
+	});
+}
+
+
+function poll_calendar_job(job_url) {
+	// events are added to google calendar in the background, wait for the job (or batch of jobs) to finish
+	$.getJSON(job_url, function (job) {
+		if (job['status'] == 'pending' || job['status'] == 'running') {
+			setTimeout(function () { poll_calendar_job(job_url); }, 1000);
+		} else if (job['retry_url']) {
+			location.href = job['retry_url'];
+		} else {
+			$("#info-alert").remove();
+			if (job['jobs']) {
+				var num_added = job['jobs'].filter(function (batch_job) { return batch_job['status'] == 'done'; }).length;
+				show_alert((num_added == job['jobs'].length) ? 'success' : 'danger',
+						   num_added + " of " + job['jobs'].length + " events added to Google Calendar");
+			} else if (job['status'] == 'done') {
+				show_alert('success', 'Event added to Google Calendar');
+			} else {
+				show_alert('danger', 'Event could not be added to Google Calendar');
+			}
+		}
+	});
+}
+
+
+function show_alert(category, message) {
+	$("<div>").attr("class", "alert alert-" + category)
+			  .attr("id", category + "-alert")
+			  .text(message)
+			  .insertBefore("#events-container");
+	setTimeout(function () { $("#" + category + "-alert").hide()}, 2000);
+}
+
+
+function scroll_to_event(scroll) {
+	// the event may be on a page that has not been loaded yet
+	var element = document.getElementById(scroll);
+	if (element) {
+		element.scrollIntoView();
+	} else if (next_cursor) {
+		load_more_events(function () { scroll_to_event(scroll); });
+	}
+}
+
+
+function load_more_events(callback) {
+	if (loading_events || !next_cursor) {
+		return;
 	}
+	loading_events = true;
+	$.getJSON("/events", {"cursor": next_cursor}, function (page) {
+		next_cursor = page['next_cursor'];
+		process_event_data({"all_events": page['events']});
+		$("[data-toggle=tooltip").tooltip();
+		loading_events = false;
+		if (callback) {
+			callback();
+		}
+	}).fail(function () {
+		loading_events = false;
+	});
 }
 
 
@@ -30,15 +108,26 @@ function show_events(data) {
 	}
 	for (item_index in data['all_events']) {
 		var item = data["all_events"][item_index];
-		var row = primary_container.append("div")
-								   .attr("class", "row");
 
-			row.append("div")
-				.attr("class", "event-group-header")
-				.html(item.key);
+		// a page can continue the last date of the previous page
+		var last_row = primary_container.select(".row:last-child");
+		if (!last_row.empty() && last_row.attr("data-date") == item.key) {
+			var row = last_row;
+		} else {
+			var row = primary_container.append("div")
+									   .attr("class", "row")
+									   .attr("data-date", item.key);
+
+				row.append("div")
+					.attr("class", "event-group-header")
+					.html(item.key);
+		}
 
 		for (event_index in item.values) {
 			var event = item.values[event_index];
+			if (event['user_flag'] === undefined) {
+				event['user_flag'] = (event['event_id'] in selected_event_ids);
+			}
 			var event_card = row.append("div")
 								.attr("id", "event_" + event["event_id"])
 								.attr("class", "card event");
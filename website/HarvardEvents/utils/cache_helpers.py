@@ -0,0 +1,233 @@
+import bisect
+import collections
+import datetime
+import threading
+
+import cachetools
+from flask import json
+
+from HarvardEvents import app, db
+from HarvardEvents import models
+from HarvardEvents.utils import query_helpers
+
+# name of the cache_versions row bumped whenever events are written, by the website and the scraper
+EVENTS_VERSION_NAME = 'events'
+
+# upcoming events shared by every request of the process: the (minute, events version) key they were built for,
+# their tiles, their (start_time, id) page keys and the json of each tile, without user flags
+UpcomingEvents = collections.namedtuple('UpcomingEvents', ['key', 'tiles', 'page_keys', 'tile_jsons'])
+upcoming_events_cache = {'events': None}
+upcoming_events_lock = threading.Lock()
+
+# rendered pages and page fragments shared by every user, keyed by the events version they were rendered from
+fragment_cache = cachetools.LRUCache(maxsize=1024)
+fragment_cache_lock = threading.Lock()
+
+# users loaded by flask_login, detached from any session. Other worker processes can't invalidate them, so they
+# are only trusted for USER_CACHE_TTL seconds
+user_cache = cachetools.TTLCache(maxsize=1024, ttl=app.config['USER_CACHE_TTL'])
+user_cache_lock = threading.Lock()
+
+
+def get_events_version():
+    """
+    Get the current version of the events table
+
+    Returns:
+        version (int): version, incremented on every write of events
+    """
+    version = (db.session.query(models.CacheVersion.version)
+                         .filter(models.CacheVersion.name == EVENTS_VERSION_NAME)
+                         .scalar())
+    return version or 0
+
+
+def bump_events_version():
+    """
+    Increment the version of the events table in the current transaction, invalidating the upcoming events cache
+    of every process once committed
+    """
+    updated = (db.session.query(models.CacheVersion)
+                         .filter(models.CacheVersion.name == EVENTS_VERSION_NAME)
+                         .update({'version': models.CacheVersion.version + 1}, synchronize_session=False))
+    if not updated:
+        db.session.add(models.CacheVersion(name=EVENTS_VERSION_NAME, version=1))
+
+
+def get_upcoming_events():
+    """
+    Get the tiles of all future events, cached per process until the minute changes or events are written
+
+    Returns:
+        upcoming_events (UpcomingEvents): tiles of the events ordered by (start time, id), with their page keys
+            and their serialized json, see `UpcomingEvents`
+    """
+    key = (query_helpers.get_current_datetime(), get_events_version())
+    with upcoming_events_lock:
+        upcoming_events = upcoming_events_cache['events']
+    if upcoming_events is not None and upcoming_events.key == key:
+        return upcoming_events
+
+    event_tiles = query_helpers.get_event_tiles('anonymous')
+    upcoming_events = UpcomingEvents(key=key,
+                                     tiles=[tile for tile, _, _ in event_tiles],
+                                     page_keys=[(start_time, tile.event_id) for tile, start_time, _ in event_tiles],
+                                     tile_jsons=[json.htmlsafe_dumps(tile._asdict()) for tile, _, _ in event_tiles])
+    with upcoming_events_lock:
+        upcoming_events_cache['events'] = upcoming_events
+    return upcoming_events
+
+
+def encode_page_cursor(page_key):
+    """
+    Encode the page key of the last event of a page as the cursor of the next page
+
+    Arguments:
+        page_key (tuple): (start time, id) of the event
+
+    Returns:
+        cursor (str): cursor of the next page
+    """
+    start_time, event_id = page_key
+    return '{0:%Y-%m-%dT%H:%M:%S.%f}_{1}'.format(start_time, event_id)
+
+
+def decode_page_cursor(cursor):
+    """
+    Decode a cursor created by `encode_page_cursor`
+
+    Arguments:
+        cursor (str): cursor of a page
+
+    Returns:
+        page_key (tuple): (start time, id) of the last event of the previous page
+
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    start_time, event_id = cursor.split('_')
+    return datetime.datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S.%f'), int(event_id)
+
+
+def get_upcoming_events_page(upcoming_events, cursor=None, page_size=50):
+    """
+    Get a page of the tile data of future events, keyed on (start_time, id) so that pages stay consistent while
+    events are added or deleted between requests. The page is joined from the cached json of each tile, so it
+    costs the same whatever the number of events
+
+    Arguments:
+        upcoming_events (UpcomingEvents): upcoming events returned by `get_upcoming_events`
+        cursor (str): cursor returned with the previous page, None for the first page
+        page_size (int): max number of events in the page
+
+    Returns:
+        events_json (str): json array of the tile data of the events of the page, without user flags
+        next_cursor (str or None): cursor of the next page, None if this is the last page
+
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    page_keys = upcoming_events.page_keys
+    start = bisect.bisect_right(page_keys, decode_page_cursor(cursor)) if cursor else 0
+    end = start + page_size
+    next_cursor = encode_page_cursor(page_keys[end - 1]) if end < len(page_keys) else None
+    events_json = '[{0}]'.format(','.join(upcoming_events.tile_jsons[start:end]))
+    return events_json, next_cursor
+
+
+def get_user_selected_event_ids(user_id):
+    """
+    Get the ids of the events a user has added to their calendar
+
+    Arguments:
+        user_id (str): id of user
+
+    Returns:
+        event_ids (set of ints): ids of the events
+    """
+    event_ids = set(event_id for event_id, in db.session.query(query_helpers.user_selected_events_subquery(user_id)))
+    return event_ids
+
+
+def search_events(user_id, search_term):
+    """
+    Search future events through the full text index. Search terms with only words the index can't match (short
+    words like "UN" and stopwords) are matched as substrings of the titles of the cached upcoming events instead, so
+    that no search scans the events table
+
+    Arguments:
+        user_id (str): user id of current session
+        search_term (str): user search term
+
+    Returns:
+        event_tiles (list of tuples): (`models.EventTile`, start time, id of the event if the user has added it to
+            their calendar else None) of each matching event, see `query_helpers.get_event_tiles`
+    """
+    if query_helpers.create_search_query(search_term) is not None:
+        return query_helpers.get_event_tiles(user_id, search_term)
+
+    upcoming_events = get_upcoming_events()
+    selected_event_ids = get_user_selected_event_ids(user_id) if user_id != 'anonymous' else set()
+    title_term = search_term.lower()
+    event_tiles = [(tile, start_time, tile.event_id if tile.event_id in selected_event_ids else None)
+                   for tile, (start_time, _) in zip(upcoming_events.tiles, upcoming_events.page_keys)
+                   if title_term in tile.title.lower()]
+    return event_tiles
+
+
+def get_fragment(key, render):
+    """
+    Get a rendered fragment from the fragment cache, rendering it on a miss. Keys should include the events
+    version of the events rendered, fragments of older versions are evicted as new ones are cached
+
+    Arguments:
+        key (tuple): key of the fragment
+        render (callable): function without arguments returning the fragment
+
+    Returns:
+        fragment (str): rendered fragment
+    """
+    with fragment_cache_lock:
+        fragment = fragment_cache.get(key)
+    if fragment is None:
+        fragment = render()
+        with fragment_cache_lock:
+            fragment_cache[key] = fragment
+    return fragment
+
+
+def get_user(user_id):
+    """
+    Get a user, from the user cache if it was loaded in the last USER_CACHE_TTL seconds
+
+    Arguments:
+        user_id (str): id of user
+
+    Returns:
+        user (HarvardEvents.models.User or None): user attached to the current session, None if there is no such
+            user
+    """
+    with user_cache_lock:
+        cached_user = user_cache.get(user_id)
+    if cached_user is None:
+        cached_user = db.session.query(models.User).filter_by(id=user_id).first()
+        if cached_user is None:
+            return None
+        db.session.expunge(cached_user)
+        with user_cache_lock:
+            user_cache[user_id] = cached_user
+
+    # attach a copy to the session without querying the db, the cached instance stays detached
+    user = db.session.merge(cached_user, load=False)
+    return user
+
+
+def invalidate_user(user_id):
+    """
+    Remove a user from the user cache of this process, call after changing the user
+
+    Arguments:
+        user_id (str): id of user
+    """
+    with user_cache_lock:
+        user_cache.pop(user_id, None)
@@ -0,0 +1,271 @@
+import datetime
+import random
+import socket
+import threading
+import uuid
+
+import httplib2
+from apiclient import errors
+from google.auth.exceptions import RefreshError
+
+from HarvardEvents import app, db
+from HarvardEvents import models
+from HarvardEvents.utils import google_helpers
+from HarvardEvents.utils.thread_helpers import ProcessThreads
+
+# error of jobs that failed because the user's access token expired, the user has to log in again to retry
+TOKEN_EXPIRED_ERROR = 'token_expired'
+
+# max requests in a google batch http request
+MAX_BATCH_SIZE = 50
+
+
+class CalendarJobWorker(object):
+    """
+    Pool of threads inserting the events of the calendar_jobs table into the users' Google Calendars. Jobs are
+    claimed with a conditional update so that the pools of several worker processes can share the table, and
+    failed inserts are retried with exponential backoff
+    """
+
+    def __init__(self, num_workers=4, max_attempts=5, poll_interval=5, backoff_base=2, backoff_max=300,
+                 stale_after=300):
+        """
+        Initialize worker
+
+        Arguments:
+            num_workers (int): number of threads inserting events
+            max_attempts (int): attempts of a job before it fails
+            poll_interval (float): max seconds between checks of the table for jobs of other processes and retries
+            backoff_base (float): seconds waited before the first retry, doubled for each retry after that
+            backoff_max (float): max seconds waited before a retry
+            stale_after (float): seconds after which a running job is assumed to have been abandoned by a process
+                that died, and is claimed again
+        """
+        self.num_workers = num_workers
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stale_after = stale_after
+        self.wakeup = threading.Event()
+        self.process_threads = ProcessThreads(self.start_threads)
+
+    def enqueue(self, user_id, event_id, selection_source):
+        """
+        Add a job to the current transaction, call `notify` once committed
+
+        Arguments:
+            user_id (str): id of user
+            event_id (str): id of the event being added to the user's calendar
+            selection_source (str): location of link
+
+        Returns:
+            job (HarvardEvents.models.CalendarJob): pending job
+        """
+        now = datetime.datetime.today()
+        job = models.CalendarJob(user_id=user_id,
+                                 event_id=event_id,
+                                 selection_source=selection_source,
+                                 status='pending',
+                                 attempts=0,
+                                 created_at=now,
+                                 updated_at=now,
+                                 next_attempt_at=now)
+        db.session.add(job)
+        return job
+
+    def enqueue_batch(self, user_id, event_ids, selection_source):
+        """
+        Add jobs for several events with one insert statement in the current transaction, call `notify` once
+        committed. The events of the batch are inserted with one google batch http request
+
+        Arguments:
+            user_id (str): id of user
+            event_ids (list of ints): ids of the events being added to the user's calendar, at most MAX_BATCH_SIZE
+            selection_source (str): location of link
+
+        Returns:
+            batch_id (str): id of the batch, see `models.CalendarJob.batch_id`
+        """
+        now = datetime.datetime.today()
+        batch_id = uuid.uuid4().hex
+        db.session.execute(models.CalendarJob.__table__.insert().values([
+            {'user_id': user_id,
+             'event_id': event_id,
+             'selection_source': selection_source,
+             'batch_id': batch_id,
+             'status': 'pending',
+             'attempts': 0,
+             'created_at': now,
+             'updated_at': now,
+             'next_attempt_at': now} for event_id in event_ids]))
+        return batch_id
+
+    def notify(self):
+        """
+        Wake the threads to pick up a committed job, starting them if they aren't running in this process
+        """
+        self.start()
+        self.wakeup.set()
+
+    def start(self):
+        """
+        Start the threads if they aren't running in this process, see `ProcessThreads`. Pending jobs of any process
+        are picked up by the threads of every process that has started them
+        """
+        self.process_threads.start()
+
+    def start_threads(self):
+        for index in range(self.num_workers):
+            thread = threading.Thread(target=self.run, name='calendar-job-worker-{0}'.format(index), daemon=True)
+            thread.start()
+
+    def run(self):
+        while True:
+            try:
+                with app.app_context():
+                    ran_jobs = self.run_next_jobs()
+            except Exception as error:
+                print('Calendar job worker failed: {0!r}'.format(error))
+                ran_jobs = False
+            if not ran_jobs:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+
+    def claim_next_jobs(self):
+        """
+        Claim the next due job, or a running job abandoned by a process that died, along with the other due jobs of
+        its batch. Jobs are claimed with one conditional update, so only one thread in any process can move them
+        out of the state they were read in
+
+        Returns:
+            jobs (list of HarvardEvents.models.CalendarJob): jobs claimed by this thread, all of the same user, empty
+                if there are no jobs
+        """
+        now = datetime.datetime.today()
+        claim_id = uuid.uuid4().hex
+        CalendarJob = models.CalendarJob
+        # read plain rows rather than instances, which would be reloaded with the claimed state after a commit
+        due_jobs = (db.session.query(CalendarJob.id, CalendarJob.status, CalendarJob.updated_at, CalendarJob.batch_id)
+                              .filter(db.or_(db.and_(CalendarJob.status == 'pending',
+                                                     CalendarJob.next_attempt_at <= now),
+                                             db.and_(CalendarJob.status == 'running',
+                                                     CalendarJob.updated_at <= now - datetime.timedelta(
+                                                         seconds=self.stale_after))))
+                              .order_by(CalendarJob.next_attempt_at)
+                              .limit(self.num_workers)
+                              .all())
+        for job in due_jobs:
+            claimable = db.and_(CalendarJob.id == job.id,
+                                CalendarJob.status == job.status,
+                                CalendarJob.updated_at == job.updated_at)
+            if job.batch_id is not None:
+                claimable = db.or_(claimable, db.and_(CalendarJob.batch_id == job.batch_id,
+                                                      CalendarJob.status == 'pending',
+                                                      CalendarJob.next_attempt_at <= now))
+            claimed = (db.session.query(CalendarJob)
+                                 .filter(claimable)
+                                 .update({'status': 'running',
+                                          'attempts': CalendarJob.attempts + 1,
+                                          'updated_at': now,
+                                          'claim_id': claim_id},
+                                         synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                return db.session.query(CalendarJob).filter(CalendarJob.claim_id == claim_id).all()
+        return []
+
+    def insert_events(self, jobs):
+        """
+        Insert the events of jobs of a user into the user's calendar, in one batch http request if there are several
+
+        Arguments:
+            jobs (list of HarvardEvents.models.CalendarJob): jobs of the same user
+
+        Returns:
+            job_errors (dict): exception of each job keyed by job id, None if the event was inserted
+        """
+        job_errors = {}
+        try:
+            user = db.session.query(models.User).filter_by(id=jobs[0].user_id).one()
+            events = {event.id: event.google_calendar_event
+                      for event in (db.session.query(models.Event)
+                                              .filter(models.Event.id.in_([job.event_id for job in jobs]))
+                                              .all())}
+            service = google_helpers.build_service('calendar', 'v3', user.token)
+
+            # jobs of events deleted since they were queued fail on their own
+            for job in jobs:
+                if job.event_id not in events:
+                    job_errors[job.id] = LookupError('Event {0} not found'.format(job.event_id))
+            insert_jobs = [job for job in jobs if job.id not in job_errors]
+
+            if len(insert_jobs) == 1:
+                job = insert_jobs[0]
+                service.events().insert(calendarId='primary', body=events[job.event_id]).execute()
+                job_errors[job.id] = None
+            elif insert_jobs:
+                def record_response(request_id, response, exception):
+                    job_errors[int(request_id)] = exception
+
+                batch = service.new_batch_http_request(callback=record_response)
+                for job in insert_jobs:
+                    batch.add(service.events().insert(calendarId='primary', body=events[job.event_id]),
+                              request_id=str(job.id))
+                batch.execute()
+
+        # an error of the whole request is the error of every job without a response
+        except Exception as error:
+            for job in jobs:
+                job_errors.setdefault(job.id, error)
+        return job_errors
+
+    def finish_job(self, job, error, jitter):
+        """
+        Record the outcome of a job, scheduling a retry for timeouts, connection errors and 429 / 5xx responses
+
+        Arguments:
+            job (HarvardEvents.models.CalendarJob): claimed job
+            error (Exception or None): exception inserting the job's event, None if it was inserted
+            jitter (float): fraction of the backoff waited before a retry, shared by the jobs of a batch so that
+                they are retried together
+        """
+        if error is None:
+            job.status = 'done'
+            job.error = None
+        elif isinstance(error, RefreshError):
+            job.status = 'failed'
+            job.error = TOKEN_EXPIRED_ERROR
+        elif isinstance(error, (errors.HttpError, httplib2.HttpLib2Error, socket.error)):
+            job.error = repr(error)
+            retryable = not isinstance(error, errors.HttpError) or error.resp.status == 429 or error.resp.status >= 500
+            if retryable and job.attempts < self.max_attempts:
+                job.status = 'pending'
+                backoff = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+                job.next_attempt_at = datetime.datetime.today() + datetime.timedelta(seconds=backoff * jitter)
+            else:
+                job.status = 'failed'
+        else:
+            job.status = 'failed'
+            job.error = repr(error)
+        job.updated_at = datetime.datetime.today()
+
+    def run_next_jobs(self):
+        """
+        Claim the next jobs and insert their events into the user's calendar
+
+        Returns:
+            ran_jobs (bool): whether there were jobs to run
+        """
+        jobs = self.claim_next_jobs()
+        if not jobs:
+            db.session.remove()
+            return False
+
+        job_errors = self.insert_events(jobs)
+        jitter = random.uniform(0.5, 1)
+        for job in jobs:
+            self.finish_job(job, job_errors.get(job.id), jitter)
+        db.session.commit()
+        db.session.remove()
+        return True
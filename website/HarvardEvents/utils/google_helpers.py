@@ -0,0 +1,148 @@
+"""
+Factory for Google API services. Discovery documents are read from the committed HarvardEvents/discovery bundle,
+loaded once per process at startup (see application.py) so no request waits on Google for them, and requests reuse
+a connection pool per thread instead of opening a new TLS connection per request.
+
+Update the bundled discovery documents, then commit them, with:
+    python -m HarvardEvents.utils.google_helpers
+"""
+import json
+import os
+import threading
+
+import google.oauth2.credentials
+import google_auth_httplib2
+import httplib2
+from apiclient import discovery, errors
+
+# directory of the bundled discovery documents, named <api>.<version>.json
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'discovery')
+
+# apis used by the site, whose discovery documents are bundled
+DISCOVERY_APIS = [('calendar', 'v3'), ('oauth2', 'v2')]
+
+# parsed discovery documents keyed by (api, version)
+discovery_documents = {}
+discovery_documents_lock = threading.Lock()
+
+# httplib2.Http keeps alive its connections but isn't thread safe, so each thread gets its own
+http_local = threading.local()
+
+
+def get_http():
+    """
+    Get the shared http client of the current thread
+
+    Returns:
+        http (httplib2.Http): http client, keeping its connections to Google alive between requests
+    """
+    if not hasattr(http_local, 'http'):
+        http_local.http = httplib2.Http(timeout=30)
+    return http_local.http
+
+
+def fetch_discovery_document(api, version):
+    """
+    Fetch a discovery document from Google
+
+    Arguments:
+        api (str): name of the api, e.g. 'calendar'
+        version (str): version of the api, e.g. 'v3'
+
+    Returns:
+        document (str): discovery document
+    """
+    url = discovery.DISCOVERY_URI.format(api=api, apiVersion=version)
+    response, content = get_http().request(url)
+    if response.status >= 400:
+        raise errors.HttpError(response, content, uri=url)
+    return content.decode('utf-8')
+
+
+def get_discovery_document_path(api, version):
+    """
+    Get the path of the bundled discovery document of an api
+
+    Arguments:
+        api (str): name of the api, e.g. 'calendar'
+        version (str): version of the api, e.g. 'v3'
+
+    Returns:
+        path (str): path of the document in DISCOVERY_DIR
+    """
+    return os.path.join(DISCOVERY_DIR, '{0}.{1}.json'.format(api, version))
+
+
+def load_discovery_documents():
+    """
+    Parse the bundled discovery documents of the apis used by the site, called at startup so that a deploy without
+    them fails instead of every worker process fetching them from Google
+
+    Raises:
+        RuntimeError: if a discovery document isn't bundled
+    """
+    missing_paths = [get_discovery_document_path(api, version) for api, version in DISCOVERY_APIS
+                     if not os.path.exists(get_discovery_document_path(api, version))]
+    if missing_paths:
+        raise RuntimeError('Missing Google discovery documents {0}, fetch them with '
+                           '`python -m HarvardEvents.utils.google_helpers` and commit them'.format(
+                               ', '.join(missing_paths)))
+    for api, version in DISCOVERY_APIS:
+        get_discovery_document(api, version)
+
+
+def get_discovery_document(api, version):
+    """
+    Get the parsed bundled discovery document of an api, read once per process
+
+    Arguments:
+        api (str): name of the api, e.g. 'calendar'
+        version (str): version of the api, e.g. 'v3'
+
+    Returns:
+        document (dict): discovery document
+    """
+    with discovery_documents_lock:
+        document = discovery_documents.get((api, version))
+    if document is None:
+        with open(get_discovery_document_path(api, version)) as document_file:
+            document = json.load(document_file)
+        with discovery_documents_lock:
+            discovery_documents[(api, version)] = document
+    return document
+
+
+def build_service(api, version, access_token):
+    """
+    Build a service for an api acting as a user
+
+    Arguments:
+        api (str): name of the api, e.g. 'calendar'
+        version (str): version of the api, e.g. 'v3'
+        access_token (str): oauth access token of the user
+
+    Returns:
+        service (googleapiclient.discovery.Resource): service of the api, requests of which raise
+            google.auth.exceptions.RefreshError if the access token has expired
+    """
+    credentials = google.oauth2.credentials.Credentials(access_token)
+    http = google_auth_httplib2.AuthorizedHttp(credentials, http=get_http())
+    service = discovery.build_from_document(get_discovery_document(api, version), http=http)
+    return service
+
+
+def update_discovery_documents():
+    """
+    Fetch the discovery documents of the apis used by the site into the bundled directory
+    """
+    if not os.path.isdir(DISCOVERY_DIR):
+        os.makedirs(DISCOVERY_DIR)
+    for api, version in DISCOVERY_APIS:
+        path = get_discovery_document_path(api, version)
+        with open(path, 'w') as document_file:
+            document_file.write(fetch_discovery_document(api, version))
+        print('Updated {0}'.format(path))
+
+
+if __name__ == '__main__':
+    update_discovery_documents()
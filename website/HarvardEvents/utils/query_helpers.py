@@ -1,9 +1,32 @@
 import pytz
 import datetime
+import re
 
 from HarvardEvents import db
 from HarvardEvents import models
 
+# boolean full text match over the columns of the FULLTEXT index on events (see `models.Event`), which evaluates
+# to the relevance of the event for the query built by `create_search_query`
+SEARCH_RELEVANCE = ('MATCH (events.description, events.title, events.policy_topics, events.academic_areas, '
+                    'events.geographic_regions, events.degrees_programs, events.centers_initiatives) '
+                    'AGAINST (:search_query IN BOOLEAN MODE)')
+
+# words the full text index can't match: words shorter than innodb_ft_min_token_size and InnoDB's default stopwords
+SEARCH_MIN_TOKEN_SIZE = 3
+SEARCH_STOPWORDS = frozenset(['a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from',
+                              'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to',
+                              'was', 'what', 'when', 'where', 'who', 'will', 'with', 'und', 'www'])
+
+
+def get_current_datetime():
+    """
+    Current time in Boston to the minute, which is what separates upcoming from past events
+
+    Returns:
+        current_datetime (str): current time formatted for queries
+    """
+    return datetime.datetime.now(pytz.timezone('US/Eastern')).strftime('%Y-%m-%d %H:%M:00')
+
 
 def user_selected_events_subquery(user_id):
     """
@@ -22,40 +45,131 @@ def user_selected_events_subquery(user_id):
     return subquery
 
 
-def get_events_query(user_id, search_term=None):
+def get_user_events(user_id):
+    """
+    Get the events a user has submitted or added to their calendar with one query, tagged with the group of the
+    preferences page they are listed in
+
+    Arguments:
+        user_id (str): id of user
+
+    Returns:
+        events (list of tuples): (id, title, group, upcoming flag) of each event ordered by start time, group is
+            'submitted', 'upcoming' or 'previous'. Submitted events the user also added to their calendar are
+            returned once per group
+    """
+    now = datetime.datetime.today()
+    upcoming_flag = db.case([(models.Event.start_time > now, True)], else_=False).label('upcoming_flag')
+
+    # each part of the union is served by its own index: events (source_id, start_time) for the events the user
+    # submitted, selected_events (user_id, selection_type, event_id) for the events added to their calendar
+    submitted_query = (db.session.query(models.Event.id,
+                                        models.Event.title,
+                                        models.Event.start_time,
+                                        db.literal('submitted').label('event_group'),
+                                        upcoming_flag)
+                                 .filter(models.Event.source_id == user_id))
+    selected_query = (db.session.query(models.Event.id,
+                                       models.Event.title,
+                                       models.Event.start_time,
+                                       db.case([(models.Event.start_time > now, 'upcoming')],
+                                               else_='previous').label('event_group'),
+                                       upcoming_flag)
+                                .filter(models.Event.id.in_(user_selected_events_subquery(user_id))))
+    events = [(id, title, event_group, bool(flag))
+              for id, title, _, event_group, flag in (submitted_query.union_all(selected_query)
+                                                                      .order_by(models.Event.start_time)
+                                                                      .all())]
+    return events
+
+
+def create_search_query(search_term):
     """
-    Returns query results getting future events, either all of them or those matching a search term
+    Build the boolean mode full text query of a search term, matching any of its words as a prefix so that
+    partial words (e.g. "econ") match
+
+    Arguments:
+        search_term (str): user search term
+
+    Returns:
+        search_query (str or None): query for SEARCH_RELEVANCE, None if no word of the search term can be matched by
+            the full text index
+    """
+    tokens = [token for token in re.findall(r'\w+', search_term.lower())
+              if len(token) >= SEARCH_MIN_TOKEN_SIZE and token not in SEARCH_STOPWORDS]
+    if not tokens:
+        return None
+    search_query = ' '.join('{0}*'.format(token) for token in tokens)
+    return search_query
+
+
+def get_event_tiles(user_id, search_term=None):
+    """
+    Returns the tiles of future events, either all of them or those matching a search term in the full text index
+    ranked by relevance. Tiles are read from the tile_json column written with the events, into plain rows rather
+    than `models.Event` instances
 
     Arguments:
         user_id (str): user id of current session
-        search_term (str): user search term, if None return all events
+        search_term (str): user search term, if None return all events. No events match a search term without
+            words the full text index can match, see `cache_helpers.search_events`
+
+    Returns:
+        event_tiles (list of tuples): (`models.EventTile`, start time, id of the event if the user has added it to
+            their calendar else None) of each event
     """
-    current_datetime = datetime.datetime.now(pytz.timezone('US/Eastern')).strftime('%Y-%m-%d %H:%M:00')
+    current_datetime = get_current_datetime()
     event_user_subquery = user_selected_events_subquery(user_id)
+    event_query = (db.session.query(models.Event.id, models.Event.start_time, models.Event.tile_json,
+                                    event_user_subquery.c.event_id)
+                             .filter(models.Event.end_time >= current_datetime)
+                             .outerjoin(event_user_subquery))
 
     if search_term:
-        # query different fields for presence of search term,
-        # joined with event ids which user has already added to calendar
-        search_term_query = '%{0}%'.format(search_term)
-        event_query = (db.session.query(models.Event, event_user_subquery)
-                                 .filter(models.Event.end_time >= current_datetime)
-                                 .filter((models.Event.description.ilike(search_term_query)) |
-                                         (models.Event.title.ilike(search_term_query)) |
-                                         (models.Event.policy_topics.ilike(search_term_query)) |
-                                         (models.Event.academic_areas.ilike(search_term_query)) |
-                                         (models.Event.geographic_regions.ilike(search_term_query)) |
-                                         (models.Event.degrees_programs.ilike(search_term_query)) |
-                                         (models.Event.centers_initiatives.ilike(search_term_query)))
-                                 .order_by(models.Event.start_time)
-                                 .outerjoin(event_user_subquery)
-                                 .all())
+        # search the full text index for the search term, most relevant first
+        search_query = create_search_query(search_term)
+        if search_query is None:
+            return []
+        relevance = db.text(SEARCH_RELEVANCE).bindparams(search_query=search_query)
+        rows = (event_query.filter(relevance)
+                           .order_by(db.desc(relevance), models.Event.start_time)
+                           .all())
 
     else:
-        # get all future events, joined with event ids which user has already added to calendar
-        event_query = (db.session.query(models.Event, event_user_subquery)
-                                 .filter(models.Event.end_time >= current_datetime)
-                                 .order_by(models.Event.start_time)
-                                 .outerjoin(event_user_subquery)
-                                 .all())
-
-    return event_query
+        # get all future events ordered by (start_time, id) so that pages of the listing have a stable key
+        rows = event_query.order_by(models.Event.start_time, models.Event.id).all()
+
+    # build the tiles of events written before tile_json was, from their tile columns
+    missing_event_ids = [event_id for event_id, _, tile_json, _ in rows if tile_json is None]
+    missing_tiles = {}
+    if missing_event_ids:
+        missing_tiles = {row.id: models.create_event_tile(row)
+                         for row in (db.session.query(*models.Event.tile_columns())
+                                               .filter(models.Event.id.in_(missing_event_ids)))}
+
+    event_tiles = [(models.load_event_tile(event_id, tile_json) if tile_json is not None else missing_tiles[event_id],
+                    start_time, flag)
+                   for event_id, start_time, tile_json, flag in rows]
+    return event_tiles
+
+
+def get_event_tile(event_id):
+    """
+    Returns the tile of an event
+
+    Arguments:
+        event_id (str): id of the event
+
+    Returns:
+        tile (models.EventTile): tile of the event
+
+    Raises:
+        sqlalchemy.orm.exc.NoResultFound: if there is no such event
+    """
+    event_id, tile_json = (db.session.query(models.Event.id, models.Event.tile_json)
+                                     .filter(models.Event.id == event_id)
+                                     .one())
+    if tile_json is not None:
+        return models.load_event_tile(event_id, tile_json)
+    row = db.session.query(*models.Event.tile_columns()).filter(models.Event.id == event_id).one()
+    return models.create_event_tile(row)
@@ -0,0 +1,38 @@
+import os
+import threading
+
+
+class ProcessThreads(object):
+    """
+    Starts the background threads of an object once in each process. Threads don't survive the fork of the
+    server's worker processes, so they are started by the first call to `start` in each of them
+    """
+
+    def __init__(self, start_threads):
+        """
+        Initialize process threads
+
+        Arguments:
+            start_threads (callable): function without arguments starting the threads
+        """
+        self.start_threads = start_threads
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @property
+    def started(self):
+        """
+        Whether the threads were started in the current process
+        """
+        return self.pid == os.getpid()
+
+    def start(self):
+        """
+        Start the threads if they haven't been started in the current process
+        """
+        if self.started:
+            return
+        with self.lock:
+            if not self.started:
+                self.start_threads()
+                self.pid = os.getpid()
@@ -0,0 +1,137 @@
+import atexit
+import collections
+import queue
+import threading
+import time
+
+from HarvardEvents.utils.thread_helpers import ProcessThreads
+
+
+class WriteBehindLog(object):
+    """
+    Buffers rows of analytics tables (searches, event selections) in a bounded in-memory queue, which a background
+    thread bulk inserts every batch_size rows or flush_interval_ms milliseconds, so that requests don't wait on a
+    commit to log them. Rows still buffered are flushed when the process exits
+    """
+
+    def __init__(self, db, batch_size=100, flush_interval_ms=500, max_queue_size=10000):
+        """
+        Initialize log
+
+        Arguments:
+            db (flask_sqlalchemy.SQLAlchemy): database the rows are inserted into
+            batch_size (int): number of buffered rows that triggers an insert
+            flush_interval_ms (float): max milliseconds a row is buffered for
+            max_queue_size (int): max rows buffered, rows logged while the buffer is full are dropped
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue = queue.Queue(max_queue_size)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        self.process_threads = ProcessThreads(self.start_thread)
+        atexit.register(self.close)
+
+    def log(self, model, **values):
+        """
+        Buffer a row to be inserted
+
+        Arguments:
+            model (flask_sqlalchemy.Model): model of the table, e.g. `Search`
+            **values: column values of the row, columns with python side defaults evaluated at insert time (like
+                timestamps) should be given explicitly
+        """
+        self.start()
+        try:
+            self.queue.put_nowait((model.__table__, values))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def start(self):
+        """
+        Start the background thread if it isn't running in this process, see `ProcessThreads`
+        """
+        self.process_threads.start()
+
+    def start_thread(self):
+        self.thread = threading.Thread(target=self.run, name='write-behind-log', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            # wait for a row, then collect rows until the batch is full or the first row has waited long enough
+            row = self.queue.get()
+            if row is None:
+                return
+            rows = [row]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    row = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if row is None:
+                    self.insert(rows)
+                    return
+                rows.append(row)
+            self.insert(rows)
+
+    def insert(self, rows):
+        """
+        Insert rows with one multi-row insert per table, falling back to inserting them one at a time so that an
+        invalid row (e.g. an unknown selection source) doesn't lose the rest of the batch
+
+        Arguments:
+            rows (list of tuples): (table, column values) of each row
+        """
+        if not rows:
+            return
+        rows_by_table = collections.OrderedDict()
+        for table, values in rows:
+            rows_by_table.setdefault(table, []).append(values)
+
+        with self.flush_lock:
+            for table, table_rows in rows_by_table.items():
+                try:
+                    with self.db.engine.begin() as conn:
+                        conn.execute(table.insert(), table_rows)
+                except Exception:
+                    for values in table_rows:
+                        try:
+                            with self.db.engine.begin() as conn:
+                                conn.execute(table.insert(), values)
+                        except Exception as error:
+                            print('Failed to log {0} row {1}: {2!r}'.format(table.name, values, error))
+
+    def flush(self):
+        """
+        Insert every buffered row in the calling thread
+        """
+        rows = []
+        while True:
+            try:
+                row = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not None:
+                rows.append(row)
+        self.insert(rows)
+
+    def close(self):
+        """
+        Stop the background thread and insert the rows still buffered, called at exit
+        """
+        if self.thread is not None and self.process_threads.started and self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.flush_interval)
+                self.thread.join(timeout=10)
+            except queue.Full:
+                pass
+        self.flush()
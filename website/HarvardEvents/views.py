@@ -1,16 +1,19 @@
+import collections
 import datetime
 
-import httplib2
-from flask import render_template, request, url_for, redirect, make_response, flash
+from flask import render_template, request, url_for, redirect, make_response, flash, jsonify, abort, session, json
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
-from oauth2client.client import OAuth2WebServerFlow, AccessTokenCredentials, AccessTokenCredentialsError
-from apiclient import discovery
+from oauth2client.client import OAuth2WebServerFlow
 
-from HarvardEvents.models import Event, EventSelection, Search, User
+from HarvardEvents.models import Event, EventSelection, Search, User, CalendarJob, create_tile_json
 from HarvardEvents import app, db
 
 from HarvardEvents.utils import query_helpers
 from HarvardEvents.utils import event_creation_helpers
+from HarvardEvents.utils import cache_helpers
+from HarvardEvents.utils import google_helpers
+from HarvardEvents.utils.calendar_jobs import CalendarJobWorker, TOKEN_EXPIRED_ERROR, MAX_BATCH_SIZE
+from HarvardEvents.utils.write_behind import WriteBehindLog
 
 """
 Global Variables
@@ -28,6 +31,16 @@ flow = OAuth2WebServerFlow(client_id=app.config['CLIENT_ID'],
 # initialize credentials
 credentials = None
 
+# initialize write behind log of searches and event selections
+analytics_log = WriteBehindLog(db,
+                               batch_size=app.config['ANALYTICS_BATCH_SIZE'],
+                               flush_interval_ms=app.config['ANALYTICS_FLUSH_MS'],
+                               max_queue_size=app.config['ANALYTICS_QUEUE_SIZE'])
+
+# initialize pool of threads adding events to google calendars
+calendar_worker = CalendarJobWorker(num_workers=app.config['CALENDAR_WORKERS'],
+                                    max_attempts=app.config['CALENDAR_MAX_ATTEMPTS'])
+
 """
 User login handlers
 """
@@ -44,7 +57,7 @@ def load_user(user_id):
     Returns:
         user (HarvardEvents.models.User): user object
     """
-    user = db.session.query(User).filter_by(id=user_id).first()
+    user = cache_helpers.get_user(user_id)
     return user
 
 
@@ -91,39 +104,80 @@ def all_events_viewer():
     if 'search' in request.args:
         search_term = request.args.get('search')
 
-        # add search term to db
-        search_item = Search(user_id=user_id, search=search_term)
-        db.session.add(search_item)
-        db.session.commit()
+        # log search term to db
+        analytics_log.log(Search, user_id=user_id, search=search_term, date_searched=datetime.datetime.today())
     else:
         search_term = None
 
-    event_query = query_helpers.get_events_query(user_id, search_term)
-    num_events = len(event_query)
-    # loop through every event in events query and create a dict with date and events keys, with events as
-    # an item with a single list
-    template_data = {"search_term": search_term, "num_search_events": num_events}
-    template_data["all_events"] = []
-    for event_object, flag in event_query:
-        event = event_object.get_tile_data
-
-        # flag event if user has selected it before
-        event['user_flag'] = (flag is not None) if user_id != 'anonymous' else False
-        template_data["all_events"].append(event)
-
-    # if there are not events and the user has conducted a search return no search results found
-    if len(template_data["all_events"]) == 0 and 'search' in request.args:
-        flash('No Search Results found for {0}'.format(search_term), 'danger')
-        return redirect(url_for('all_events_viewer'))
-
-    # get user scroll position
+    # get user scroll position and the status url of the calendar jobs the user has started
     scroll_position = request.cookies.get('scroll_position')
-    resp = make_response(render_template('index.html',
-                                         data=template_data,
-                                         scroll=scroll_position))
+    calendar_job_url = request.cookies.get('calendar_job')
+
+    template_data = {"search_term": search_term, "next_cursor": None, "selected_event_ids": []}
+    if search_term is not None:
+        search_events = []
+        for tile, _, flag in cache_helpers.search_events(user_id, search_term):
+            event = tile._asdict()
+
+            # flag event if user has selected it before
+            event['user_flag'] = (flag is not None) if user_id != 'anonymous' else False
+            search_events.append(event)
+
+        # if there are not events and the user has conducted a search return no search results found
+        if len(search_events) == 0:
+            flash('No Search Results found for {0}'.format(search_term), 'danger')
+            return redirect(url_for('all_events_viewer'))
+        events_json = json.htmlsafe_dumps(search_events)
+        template_data["num_search_events"] = len(search_events)
+    else:
+        # only render the first page of upcoming events, the rest are loaded from events_page as the user scrolls.
+        # The page is the same for every user, the events the user has selected are flagged client side
+        upcoming_events = cache_helpers.get_upcoming_events()
+        events_json, next_cursor = cache_helpers.get_upcoming_events_page(upcoming_events,
+                                                                          page_size=app.config['EVENTS_PAGE_SIZE'])
+        template_data["next_cursor"] = next_cursor
+        if user_id != 'anonymous':
+            template_data["selected_event_ids"] = sorted(cache_helpers.get_user_selected_event_ids(user_id))
+
+    def render_page():
+        return render_template('index.html',
+                               data=template_data,
+                               events_json=events_json,
+                               scroll=scroll_position,
+                               calendar_job_url=calendar_job_url)
+
+    # the page of anonymous users without messages is the same for all of them until the upcoming events change
+    if (search_term is None and user_id == 'anonymous' and '_flashes' not in session and scroll_position is None
+            and calendar_job_url is None):
+        page_key = ('index', upcoming_events.key, app.config['EVENTS_PAGE_SIZE'])
+        resp = make_response(cache_helpers.get_fragment(page_key, render_page))
+    else:
+        resp = make_response(render_page())
 
-    # delete scroll position cookie
+    # delete scroll position and calendar job cookies
     resp.set_cookie('scroll_position', expires=0)
+    resp.set_cookie('calendar_job', expires=0)
+    return resp
+
+
+@app.route('/events')
+def events_page():
+    """
+    Returns a page of upcoming events as json, for infinite scrolling of the main page. The page is the same for
+    every user, the events the user has selected are flagged client side
+
+    Returns:
+        resp (Flask Response): json with the tile data of the events and the cursor of the next page, which is
+            null for the last page
+    """
+    try:
+        events_json, next_cursor = cache_helpers.get_upcoming_events_page(cache_helpers.get_upcoming_events(),
+                                                                          request.args.get('cursor'),
+                                                                          app.config['EVENTS_PAGE_SIZE'])
+    except ValueError:
+        abort(400)
+    resp = app.response_class('{{"events": {0}, "next_cursor": {1}}}'.format(events_json, json.dumps(next_cursor)),
+                              mimetype='application/json')
     return resp
 
 
@@ -142,18 +196,23 @@ def individual_event_viewer(event_id, selection_source):
     # TODO: make this do it doesn't have to be called every page
     user_id = current_user.id if current_user.is_authenticated else 'anonymous'
 
-    # add the user click to the db
-    selected_event = EventSelection(user_id=user_id,
-                                    event_id=event_id,
-                                    selection_type='link',
-                                    selection_source=selection_source)
-    db.session.add(selected_event)
-    db.session.commit()
+    def render_page():
+        event = query_helpers.get_event_tile(event_id)._asdict()
+        return render_template('individual_event.html', data=event)
+
+    page_key = ('individual_event', event_id, current_user.is_authenticated, cache_helpers.get_events_version())
+    page = cache_helpers.get_fragment(page_key, render_page)
+
+    # log the user click to the db
+    analytics_log.log(EventSelection,
+                      user_id=user_id,
+                      event_id=event_id,
+                      selection_type='link',
+                      selection_source=selection_source,
+                      date_selected=datetime.datetime.today())
 
     # create response
-    event = db.session.query(Event).filter_by(id=event_id).one().get_tile_data
-    resp = make_response(render_template('individual_event.html',
-                                         data=event))
+    resp = make_response(page)
     resp.set_cookie('scroll_position', 'event_{}'.format(event_id))
     return resp
 
@@ -167,28 +226,17 @@ def view_preferences():
     Returns:
         resp (Flask Response): User preferences page
     """
-    # get events submitted by individual user
-    submitted_events = [{'id': id, 'title': title, 'upcoming_flag': (start_time > datetime.datetime.today())}
-                        for id, title, start_time in
-                        (db.session.query(Event.id, Event.title, Event.start_time)
-                                   .filter(Event.source_id == current_user.id)
-                                   .order_by(Event.start_time)
-                                   .all())]
-
-    # get events user has added to calendar
-    today = datetime.datetime.today()
-    event_user_subquery = query_helpers.user_selected_events_subquery(current_user.id)
-    previous_events = [{'id': id, 'title': title}
-                       for id, title in (db.session.query(Event.id, Event.title)
-                       .filter(Event.id.in_(event_user_subquery))
-                       .filter(Event.start_time <= today)
-                       .all())]
-
-    upcoming_events = [{'id': id, 'title': title}
-                       for id, title in (db.session.query(Event.id, Event.title)
-                       .filter(Event.id.in_(event_user_subquery))
-                       .filter(Event.start_time > today)
-                       .all())]
+    # get events submitted by the user and events the user has added to calendar, in one query
+    submitted_events = []
+    previous_events = []
+    upcoming_events = []
+    for id, title, event_group, upcoming_flag in query_helpers.get_user_events(current_user.id):
+        if event_group == 'submitted':
+            submitted_events.append({'id': id, 'title': title, 'upcoming_flag': upcoming_flag})
+        elif event_group == 'upcoming':
+            upcoming_events.append({'id': id, 'title': title})
+        else:
+            previous_events.append({'id': id, 'title': title})
 
     data = {"email": current_user.email,
             "daily_subscribed": current_user.daily_subscribed,
@@ -247,6 +295,7 @@ def change_preferences():
         flash('Subscription Preferences Changed', 'success')
     else:
         flash('No Preferences Changed', 'warning')
+    cache_helpers.invalidate_user(current_user.id)
 
     preference_redirect = redirect(url_for('view_preferences'))
     return preference_redirect
@@ -269,11 +318,18 @@ def add_event():
         # either update an existing event or create a new event
         event_object = event_creation_helpers.create_event_db_object(request.form, current_user.id)
         if 'edit' in request.args:
-            event = db.session.query(Event).filter(Event.id == request.args.get('edit'))
-            event.update(event_object)
+            event_query = db.session.query(Event).filter(Event.id == request.args.get('edit'))
+            event_query.update(event_object)
+            event = event_query.one()
         else:
             event = Event(**event_object)
             db.session.add(event)
+            db.session.flush()
+
+        # reload the times of the event as datetimes to serialize its tile
+        db.session.refresh(event)
+        event.tile_json = create_tile_json(event)
+        cache_helpers.bump_events_version()
         db.session.commit()
         flash('Event Successfully Submitted', 'success')
         return redirect(url_for('all_events_viewer'))
@@ -327,8 +383,10 @@ def delete_event(event_id):
         selectedevents = db.session.query(EventSelection).filter(EventSelection.event_id == event_id).all()
         for selectedevent in selectedevents:
             db.session.delete(selectedevent)
+        db.session.query(CalendarJob).filter(CalendarJob.event_id == event_id).delete(synchronize_session=False)
         db.session.commit()
         db.session.delete(event)
+        cache_helpers.bump_events_version()
         db.session.commit()
         flash('Event Deleted', 'success')
 
@@ -354,35 +412,24 @@ def add_to_google_calendar(event_id, selection_source):
         resp (Flask Response): Varies depending on whether user is logged in
     """
     if current_user.is_authenticated:
-        try:
-            # adds user selection to database
-            selected_event = EventSelection(user_id=current_user.id,
-                                            event_id=event_id,
-                                            selection_type='calendar',
-                                            selection_source=selection_source,
-                                            date_selected=datetime.datetime.today())
-            db.session.add(selected_event)
-            db.session.commit()
-
-            # gets google calendar event of object
-            event = db.session.query(Event).filter_by(id=event_id).one().google_calendar_event
-
-            # add event to google calendar
-            credentials = AccessTokenCredentials(current_user.token, None)
-            http = credentials.authorize(httplib2.Http())
-            service = discovery.build('calendar', 'v3', http=http)
-            event = service.events().insert(calendarId='primary', body=event).execute()
-
-            # redirect user to main page
-            flash('Event added to Google Calendar', 'success')
-            resp = make_response(redirect(url_for('all_events_viewer')))
-            resp.set_cookie('add_event', 'false')
-            resp.set_cookie('scroll_position', 'event_{}'.format(event_id))
-            return resp
-
-        # if user token has expired log the user out and redirect to login page
-        except AccessTokenCredentialsError:
-            logout_user()
+        # adds user selection and a job adding the event to the user's google calendar to database
+        selected_event = EventSelection(user_id=current_user.id,
+                                        event_id=event_id,
+                                        selection_type='calendar',
+                                        selection_source=selection_source,
+                                        date_selected=datetime.datetime.today())
+        db.session.add(selected_event)
+        job = calendar_worker.enqueue(current_user.id, event_id, selection_source)
+        db.session.commit()
+        calendar_worker.notify()
+
+        # redirect user to main page, which polls the job until the event is added
+        flash('Adding event to Google Calendar', 'info')
+        resp = make_response(redirect(url_for('all_events_viewer')))
+        resp.set_cookie('add_event', 'false')
+        resp.set_cookie('scroll_position', 'event_{}'.format(event_id))
+        resp.set_cookie('calendar_job', url_for('calendar_job_status', job_id=job.id))
+        return resp
 
     resp = make_response(redirect(url_for('login')))
     resp.set_cookie('event_id', event_id)
@@ -391,6 +438,125 @@ def add_to_google_calendar(event_id, selection_source):
     return resp
 
 
+@app.route('/add_all_to_google_cal/<selection_source>', methods=['GET', 'POST'])
+def add_all_to_google_calendar(selection_source):
+    """
+    Adds several events to user's google calendar, e.g. from the daily email, with one google batch request. The
+    ids of the events are passed as comma separated event_ids arguments
+
+    Arguments:
+        selection_source (str): location of link
+
+    Returns:
+        resp (Flask Response): Varies depending on whether user is logged in
+    """
+    try:
+        event_ids = [int(event_id) for value in request.values.getlist('event_ids')
+                     for event_id in value.split(',') if event_id]
+    except ValueError:
+        abort(400)
+    event_ids = list(collections.OrderedDict.fromkeys(event_ids))
+    if not event_ids or len(event_ids) > MAX_BATCH_SIZE:
+        abort(400)
+
+    if current_user.is_authenticated:
+        # adds user selections and a batch of jobs adding the events to the user's google calendar to database,
+        # with one insert statement each
+        today = datetime.datetime.today()
+        db.session.execute(EventSelection.__table__.insert().values([
+            {'user_id': current_user.id,
+             'event_id': event_id,
+             'selection_type': 'calendar',
+             'selection_source': selection_source,
+             'date_selected': today} for event_id in event_ids]))
+        batch_id = calendar_worker.enqueue_batch(current_user.id, event_ids, selection_source)
+        db.session.commit()
+        calendar_worker.notify()
+
+        # redirect user to main page, which polls the jobs until the events are added
+        flash('Adding {0} events to Google Calendar'.format(len(event_ids)), 'info')
+        resp = make_response(redirect(url_for('all_events_viewer')))
+        resp.set_cookie('add_event', 'false')
+        resp.set_cookie('calendar_job', url_for('calendar_batch_status', batch_id=batch_id))
+        return resp
+
+    resp = make_response(redirect(url_for('login')))
+    resp.set_cookie('event_ids', ','.join(str(event_id) for event_id in event_ids))
+    resp.set_cookie('selection_source', selection_source)
+    resp.set_cookie('add_event', 'all')
+    return resp
+
+
+@app.route('/calendar_jobs/batch/<batch_id>')
+@login_required
+def calendar_batch_status(batch_id):
+    """
+    Status of each job of a batch adding events to the user's google calendar, polled by the main page
+
+    Arguments:
+        batch_id (str): id of the batch
+
+    Returns:
+        resp (Flask Response): json with the status of the batch (pending while any job is pending, then done if
+            every event was added and failed otherwise), the status of each job, and a retry_url to log in again
+            with if the user's token has expired
+    """
+    jobs = (db.session.query(CalendarJob)
+                      .filter_by(batch_id=batch_id, user_id=current_user.id)
+                      .order_by(CalendarJob.id)
+                      .all())
+    if not jobs:
+        abort(404)
+
+    statuses = set(job.status for job in jobs)
+    if statuses & {'pending', 'running'}:
+        status = 'pending'
+        calendar_worker.start()
+    else:
+        status = 'done' if statuses == {'done'} else 'failed'
+
+    data = {"batch_id": batch_id, "status": status, "jobs": [job.status_data for job in jobs]}
+    # if user token has expired log the user out and retry the events that failed through the login page
+    expired_event_ids = [str(job.event_id) for job in jobs
+                         if job.status == 'failed' and job.error == TOKEN_EXPIRED_ERROR]
+    if status != 'pending' and expired_event_ids:
+        logout_user()
+        data['retry_url'] = url_for('add_all_to_google_calendar', selection_source=jobs[0].selection_source,
+                                    event_ids=','.join(expired_event_ids))
+    resp = jsonify(data)
+    return resp
+
+
+@app.route('/calendar_jobs/<job_id>')
+@login_required
+def calendar_job_status(job_id):
+    """
+    Status of a job adding an event to the user's google calendar, polled by the main page
+
+    Arguments:
+        job_id (str): id of the job
+
+    Returns:
+        resp (Flask Response): json with the status of the job, and a retry_url to log in again with if the user's
+            token has expired
+    """
+    job = db.session.query(CalendarJob).filter_by(id=job_id, user_id=current_user.id).first()
+    if job is None:
+        abort(404)
+    if job.status in ('pending', 'running'):
+        # the job may have been queued by a process that has died since, poll the table from this process
+        calendar_worker.start()
+
+    data = job.status_data
+    # if user token has expired log the user out and retry through the login page
+    if job.status == 'failed' and job.error == TOKEN_EXPIRED_ERROR:
+        logout_user()
+        data['retry_url'] = url_for('add_to_google_calendar', event_id=job.event_id,
+                                    selection_source=job.selection_source)
+    resp = jsonify(data)
+    return resp
+
+
 @app.route('/google_callback')
 def callback():
     """
@@ -406,8 +572,7 @@ def callback():
         # get oauth user profile
         auth_code = request.args.get('code')
         credentials = flow.step2_exchange(auth_code)
-        http = credentials.authorize(httplib2.Http())
-        service = discovery.build('oauth2', 'v2', http=http)
+        service = google_helpers.build_service('oauth2', 'v2', credentials.access_token)
         user_profile = service.userinfo().get().execute()
         user_id = user_profile['id']
 
@@ -418,6 +583,7 @@ def callback():
         user.token = credentials.access_token
         db.session.add(user)
         db.session.commit()
+        cache_helpers.invalidate_user(user_id)
 
         login_user(user)
 
@@ -426,6 +592,10 @@ def callback():
             page_redirect = redirect(url_for('add_to_google_calendar',
                                              event_id=request.cookies.get('event_id'),
                                              selection_source=request.cookies.get('selection_source')))
+        elif request.cookies.get('add_event') == 'all':
+            page_redirect = redirect(url_for('add_all_to_google_calendar',
+                                             selection_source=request.cookies.get('selection_source'),
+                                             event_ids=request.cookies.get('event_ids')))
     # redirect to main page if login was successful or not
         else:
             flash('Login Successful', 'success')
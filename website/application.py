@@ -3,6 +3,10 @@ Runs flask application
 """
 import os
 from HarvardEvents import app as application
+from HarvardEvents.utils import google_helpers
+
+# fail the deploy if the bundled google discovery documents are missing
+google_helpers.load_discovery_documents()
 
 
 if __name__ == '__main__':
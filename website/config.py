@@ -11,3 +11,10 @@ class BaseConfig(object):
     CLIENT_SECRET = os.environ['CLIENT_SECRET']
     REDIRECT_URI = os.environ['REDIRECT_URI']
     SQLALCHEMY_TRACK_MODIFICATIONS = bool(os.environ['SQLALCHEMY_TRACK_MODIFICATIONS'])
+    EVENTS_PAGE_SIZE = int(os.environ.get('EVENTS_PAGE_SIZE', '50'))
+    ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', '100'))
+    ANALYTICS_FLUSH_MS = int(os.environ.get('ANALYTICS_FLUSH_MS', '500'))
+    ANALYTICS_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', '10000'))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '60'))
+    CALENDAR_WORKERS = int(os.environ.get('CALENDAR_WORKERS', '4'))
+    CALENDAR_MAX_ATTEMPTS = int(os.environ.get('CALENDAR_MAX_ATTEMPTS', '5'))